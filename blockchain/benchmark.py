@@ -0,0 +1,267 @@
+import base64
+import json
+import logging
+import os
+import platform
+import secrets
+import sys
+import time
+from typing import Callable, Dict, List
+import fire
+from blockchain_impl import Block, BlockChain, verify, verify_transaction_has_sufficient_funds, \
+    compute_balances, signature_cache, block_merkle_root, mining_hasher
+from custom_types import Transaction, Wallet
+from mining import PrefixHasher
+from signatures import DEFAULT_SCHEME, schemes
+from wallet_pool import take_wallets
+from utils import generate_blockchain, generate_random_transactions
+
+# results are local to the machine that ran them, tmp/ is kept out of git
+DEFAULT_OUTPUT = 'tmp/bench_results.json'
+DEFAULT_TOLERANCE = 0.25
+
+# (quick, full) sweeps
+CHAIN_LENGTHS = ([10, 50], [10, 100, 400])
+BLOCK_SIZES = ([1, 20], [1, 20, 100])
+DIFFICULTIES = ([1, 2], [1, 2, 3])
+MEMPOOL_SIZES = ([1000, 5000], [1000, 10_000, 50_000])
+
+
+def result(name: str, value: float, unit: str, higher_is_better: bool, **params) -> Dict:
+    return {
+        'name': name,
+        'params': params,
+        'value': value,
+        'unit': unit,
+        'higher_is_better': higher_is_better
+    }
+
+
+def result_key(item: Dict) -> str:
+    params = ','.join(f'{k}={v}' for k, v in sorted(item['params'].items()))
+    return f"{item['name']}[{params}]"
+
+
+def timed(func: Callable, repeat: int, number: int = 1) -> float:
+    # seconds per call, best of repeat runs of number calls each
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def bench_hash_rate(block_sizes: List[int], n_hashes: int, repeat: int) -> List[Dict]:
+    results = []
+    genesis = generate_blockchain(length=1, n_users=3)[0].chain[0]
+    miner = take_wallets(1)[0].public_key
+    for size in block_sizes:
+        block = Block(prev_block=genesis, transactions=generate_random_transactions(n_users=3, n_txn=size),
+                      reward=10, difficulty=1)
+        coinbase = block._generate_coinbase_transaction(block.reward, miner)
+        block.merkle_root = block_merkle_root(block.transactions, coinbase)
+        hashers = {
+            'legacy': mining_hasher(genesis.block_hash, block.transactions, coinbase),
+            'header': PrefixHasher(block.header().prefix(), binary_nonce=True)
+        }
+        for version, hasher in hashers.items():
+            # no hash has 64 leading zeros, so the whole range is searched
+            cost = timed(lambda: hasher.search(0, n_hashes, 64), repeat)
+            results.append(result('mining_hash_rate', n_hashes / cost, 'hashes/s', True,
+                                  block_size=size, version=version))
+    return results
+
+
+def bench_block_time(block_sizes: List[int], difficulties: List[int], n_blocks: int) -> List[Dict]:
+    results = []
+    genesis = generate_blockchain(length=1, n_users=3)[0].chain[0]
+    miner = take_wallets(1)[0].public_key
+    for size in block_sizes:
+        transactions = generate_random_transactions(n_users=3, n_txn=size)
+        # every sender is funded so the sweep measures mining, not rejected blocks
+        balances = {txn.from_addr.fingerprint: 10 ** 12 for txn in transactions}
+        for difficulty in difficulties:
+            start = time.perf_counter()
+            for _ in range(n_blocks):
+                block = Block(prev_block=genesis, transactions=list(transactions), reward=10, difficulty=difficulty)
+                block.mine(miner, balances)
+            cost = (time.perf_counter() - start) / n_blocks
+            results.append(result('mining_block_time', cost * 1e3, 'ms', False,
+                                  block_size=size, difficulty=difficulty))
+    return results
+
+
+def bench_verify(n_txn: int, repeat: int, scheme: str = DEFAULT_SCHEME) -> List[Dict]:
+    transactions = generate_random_transactions(n_users=3, n_txn=n_txn, scheme=scheme)
+
+    def run():
+        for txn in transactions:
+            verify(txn.from_addr, txn)
+
+    signature_cache.clear()
+    cold = float('inf')
+    for _ in range(repeat):
+        signature_cache.clear()
+        cold = min(cold, timed(run, 1))
+    warm = timed(run, repeat)
+    signature_cache.clear()
+    return [
+        result('verify_throughput', n_txn / cold, 'txns/s', True, cache='cold', scheme=scheme),
+        result('verify_throughput', n_txn / warm, 'txns/s', True, cache='warm', scheme=scheme)
+    ]
+
+
+def bench_keys(n_keys: int, scheme: str) -> List[Dict]:
+    start = time.perf_counter()
+    wallets = [Wallet(scheme=scheme) for _ in range(n_keys)]
+    generate = (time.perf_counter() - start) / n_keys
+    txn = Transaction(wallets[0].public_key, wallets[-1].public_key, 1)
+    sign = timed(lambda: wallets[0].sign(txn), 3, number=n_keys)
+    return [
+        result('key_generation_latency', generate * 1e3, 'ms', False, scheme=scheme),
+        result('sign_latency', sign * 1e6, 'us', False, scheme=scheme)
+    ]
+
+
+def bench_sufficient_funds(chain_lengths: List[int], repeat: int) -> List[Dict]:
+    results = []
+    for length in chain_lengths:
+        blockchain, _, _ = generate_blockchain(length=length, n_transactions=2, n_users=3)
+        block = blockchain.chain[-1]
+        txn = block.transactions[-1]
+        # what the balance index holds right before the block
+        balances = compute_balances(block.prev_block)
+        walk = timed(lambda: verify_transaction_has_sufficient_funds(block, txn), repeat, number=100)
+        indexed = timed(lambda: verify_transaction_has_sufficient_funds(block, txn, balances), repeat, number=100)
+        results.append(result('sufficient_funds_latency', walk * 1e6, 'us', False,
+                              chain_length=length, balances='walk'))
+        results.append(result('sufficient_funds_latency', indexed * 1e6, 'us', False,
+                              chain_length=length, balances='index'))
+    return results
+
+
+def bench_mempool(sizes: List[int], batch: int = 1000) -> List[Dict]:
+    results = []
+    wallets = take_wallets(3)
+    # the mempool does not check signatures, random bytes keep every txid unique without signing
+    transactions = [
+        Transaction(wallets[i % 3].public_key, wallets[(i + 1) % 3].public_key, 1, secrets.token_bytes(256))
+        for i in range(max(sizes) + batch)
+    ]
+    blockchain = BlockChain(chain=generate_blockchain(length=1)[0].chain, reward=10, difficulty=1,
+                            mempool_max_count=max(sizes) + batch)
+    filled = 0
+    for size in sorted(sizes):
+        for txn in transactions[filled:size]:
+            blockchain.add_transaction(txn)
+        filled = size
+        start = time.perf_counter()
+        for txn in transactions[size:size + batch]:
+            blockchain.add_transaction(txn)
+        cost = time.perf_counter() - start
+        blockchain.mempool.remove_transactions(transactions[size:size + batch])
+        results.append(result('add_transaction_latency', cost / batch * 1e6, 'us', False, mempool_size=size))
+    return results
+
+
+def bench_http(n_requests: int) -> List[Dict]:
+    import server
+    blockchain, _, wallets = generate_blockchain(length=2, n_users=3)
+    server.blockchain = blockchain
+    client = server.app.test_client()
+    transactions = generate_random_transactions(n_users=3, n_txn=n_requests)
+    payloads = [{
+        'sender': str(txn.from_addr),
+        'receiver': str(txn.to_addr),
+        'amount': txn.amount,
+        'signature': base64.b64encode(txn.signature).decode('utf-8'),
+        'ts': txn.ts,
+        'version': txn.version
+    } for txn in transactions]
+    start = time.perf_counter()
+    for payload in payloads:
+        resp = client.post('/transaction/new', json=payload)
+        if resp.status_code != 200:
+            raise RuntimeError(f"/transaction/new returned {resp.status_code}: {resp.get_json()}")
+    cost = time.perf_counter() - start
+    return [result('transaction_new_throughput', n_requests / cost, 'requests/s', True)]
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Returns one message per result that is worse than its baseline by more than tolerance.
+    Results missing from the baseline are not compared.
+    """
+    base = {result_key(item): item for item in baseline}
+    regressions = []
+    for item in results:
+        reference = base.get(result_key(item))
+        if reference is None or reference['value'] <= 0:
+            continue
+        change = item['value'] / reference['value'] - 1
+        regressed = change < -tolerance if item['higher_is_better'] else change > tolerance
+        if regressed:
+            regressions.append(f"{result_key(item)}: {item['value']:.2f} {item['unit']} "
+                               f"vs baseline {reference['value']:.2f} ({change:+.0%})")
+    return regressions
+
+
+def load(path: str) -> List[Dict]:
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def save(path: str, results: List[Dict]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({
+            'created': time.time(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results
+        }, f, indent=2)
+
+
+def run(output: str = DEFAULT_OUTPUT, baseline: str = None, tolerance: float = DEFAULT_TOLERANCE,
+        quick: bool = False, repeat: int = 3, save_baseline: bool = False):
+    """
+    Run every benchmark, write the results to output and compare them with baseline.
+    Exits with status 1 when any result regressed by more than tolerance.
+    """
+    # per block mining logs would drown the report
+    logging.getLogger().setLevel(logging.WARNING)
+    sweep = 0 if quick else 1
+    results = []
+    results += bench_hash_rate(BLOCK_SIZES[sweep], 20_000 if quick else 100_000, repeat)
+    results += bench_block_time(BLOCK_SIZES[sweep], DIFFICULTIES[sweep], 5 if quick else 20)
+    for scheme in schemes:
+        results += bench_keys(5 if quick else 20, scheme)
+        results += bench_verify(50 if quick else 200, repeat, scheme)
+    results += bench_sufficient_funds(CHAIN_LENGTHS[sweep], repeat)
+    results += bench_mempool(MEMPOOL_SIZES[sweep])
+    results += bench_http(50 if quick else 200)
+    for item in results:
+        print(f"{result_key(item):60s} {item['value']:14.2f} {item['unit']}")
+    save(output, results)
+    print('results written to', output)
+
+    if baseline is None:
+        return
+    if save_baseline or not os.path.exists(baseline):
+        save(baseline, results)
+        print('baseline written to', baseline)
+        return
+    regressions = compare(results, load(baseline), tolerance)
+    for message in regressions:
+        print('REGRESSION', message)
+    if regressions:
+        sys.exit(1)
+    print('no regressions against', baseline)
+
+
+if __name__ == '__main__':
+    fire.Fire({'run': run})
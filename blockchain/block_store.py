@@ -0,0 +1,141 @@
+import mmap
+import os
+import struct
+from typing import List, Iterator, Union
+from blockchain_impl import Block
+
+LOG_FILE = 'blocks.log'
+INDEX_FILE = 'blocks.idx'
+CHECKPOINT_FILE = 'checkpoint'
+
+# every log record is a 4 byte length followed by the encoded block
+RECORD_HEADER = struct.Struct('>I')
+# the index holds one 8 byte log offset per block height
+INDEX_ENTRY = struct.Struct('>Q')
+
+
+class BlockStore:
+    """
+    Append-only block log with an offset index, one record per block in height order.
+    Blocks are read back through a memory map of the log so reopening a node does not
+    re-mine or re-hash anything.
+    """
+
+    def __init__(self, directory: str, sync: bool = False):
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, LOG_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+        self.sync = sync
+        self._log = open(self.log_path, 'ab')
+        self._index = open(self.index_path, 'ab')
+        self._offsets: List[int] = self._load_offsets()
+
+    def _load_offsets(self) -> List[int]:
+        with open(self.index_path, 'rb') as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        offsets = [INDEX_ENTRY.unpack_from(data, i)[0] for i in range(0, usable, INDEX_ENTRY.size)]
+        # drop entries whose record never made it to the log, e.g. after a crash mid append
+        log_size = os.path.getsize(self.log_path)
+        while offsets and not self._record_fits(offsets[-1], log_size):
+            offsets.pop()
+        self._end = self._record_end(offsets[-1]) if offsets else 0
+        if len(data) != len(offsets) * INDEX_ENTRY.size:
+            self._index.truncate(len(offsets) * INDEX_ENTRY.size)
+        if log_size != self._end:
+            self._log.truncate(self._end)
+        return offsets
+
+    def _record_fits(self, offset: int, log_size: int) -> bool:
+        if offset + RECORD_HEADER.size > log_size:
+            return False
+        return self._record_end(offset) <= log_size
+
+    def _record_end(self, offset: int) -> int:
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            (length,) = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+        return offset + RECORD_HEADER.size + length
+
+    def append(self, block: Block):
+        payload = encode_block(block)
+        offset = self._end
+        self._log.write(RECORD_HEADER.pack(len(payload)) + payload)
+        self._end += RECORD_HEADER.size + len(payload)
+        self._log.flush()
+        self._index.write(INDEX_ENTRY.pack(offset))
+        self._index.flush()
+        if self.sync:
+            os.fsync(self._log.fileno())
+            os.fsync(self._index.fileno())
+        self._offsets.append(offset)
+
+    def extend(self, blocks: List[Block]):
+        for block in blocks:
+            self.append(block)
+
+    def records(self, start: int = 0) -> Iterator[bytes]:
+        if start >= len(self._offsets):
+            return
+        with open(self.log_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in self._offsets[start:]:
+                yield _read_record(mm, offset)
+
+    def read(self, height: int) -> bytes:
+        with open(self.log_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _read_record(mm, self._offsets[height])
+
+    def load_chain(self) -> List[Block]:
+        chain: List[Block] = []
+        prev_block = None
+        for payload in self.records():
+            block = decode_block(payload, prev_block)
+            if prev_block is not None:
+                prev_block.next_block = block
+            chain.append(block)
+            prev_block = block
+        return chain
+
+    def save_checkpoint(self, height: int):
+        # written to a temp file first so a crash never leaves a half written checkpoint
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(height))
+            if self.sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load_checkpoint(self) -> int:
+        """
+        Highest height validated before, 0 (genesis only) when there is none.
+        """
+        try:
+            with open(self.checkpoint_path) as f:
+                height = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return 0
+        # the log may have lost its tail since the checkpoint was taken
+        return min(height, len(self._offsets) - 1) if self._offsets else 0
+
+    def close(self):
+        self._log.close()
+        self._index.close()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+
+def _read_record(mm: mmap.mmap, offset: int) -> bytes:
+    (length,) = RECORD_HEADER.unpack_from(mm, offset)
+    start = offset + RECORD_HEADER.size
+    return mm[start:start + length]
+
+
+def encode_block(block: Block) -> bytes:
+    return block.to_bytes()
+
+
+def decode_block(payload: bytes, prev_block: Union[Block, None]) -> Block:
+    return Block.from_bytes(payload, prev_block)
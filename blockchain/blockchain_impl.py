@@ -1,50 +1,121 @@
 from __future__ import annotations
-from cryptography.exceptions import InvalidSignature
 import logging
+import os
+import threading
 import time
-from typing import List, Union, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, List, Union, Tuple, Dict
 from custom_types import Transaction, Wallet
 import hashlib
-from cryptography.hazmat.primitives.asymmetric import padding
 from custom_types import PublicKey, GenesisPublicKey
-from cryptography.hazmat.primitives import hashes
+import struct
+from codec import transaction_to_dict, transaction_to_bytes, transaction_from_bytes, \
+    transactions_to_bytes, transactions_from_bytes, pack_str, unpack_str, short_id, short_ids_to_bytes, \
+    short_ids_from_bytes, indexed_transactions_from_bytes
 from exceptions import *
-from client_utils import add_transaction
+from gossip import Broadcaster, BlockRelay, HOP_LIMIT
+from cache import LRUCache
+from mempool import Mempool, DEFAULT_MAX_COUNT, DEFAULT_MAX_BYTES
+from mining import parallel_mine, hash_rate, PrefixHasher, CHUNK_SIZE, MiningJob
+from header import BlockHeader, HEADER_VERSION
+from merkle import merkle_root, merkle_proof
+from validation import check_hash, check_signature, submit
+from metrics import registry
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+VERIFY_WORKERS = os.cpu_count() or 1
+# version 1 blocks hash the full text of every transaction, later versions hash a fixed-size header
+BLOCK_VERSION_LEGACY = 1
+BLOCK_VERSION_HEADER = HEADER_VERSION
+BLOCK_FORMAT = 3
+# block fields, short ids of the transactions and the coinbase, optionally followed by transactions by index
+COMPACT_BLOCK_FORMAT = 4
+# format, nonce, reward, difficulty, has coinbase, version, timestamp
+BLOCK_FIELDS = struct.Struct('>BQQIBBd')
+SIGNATURE_CACHE_SIZE = 100_000
+MAX_MINING_JOBS = 100
+# txids whose first arrival time is remembered, relayed copies of them are dropped on arrival
+SEEN_CACHE_SIZE = 100_000
+
+# (public key, transaction bytes, signature) digest -> verification result
+signature_cache = LRUCache(SIGNATURE_CACHE_SIZE)
+
+MINING_DURATION = registry.histogram('mining_duration_seconds', 'Time spent mining a block',
+                                     buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300))
+MINING_HASH_RATE = registry.gauge('mining_hash_rate', 'Hashes per second while mining the last block')
+BLOCKS_MINED = registry.counter('blocks_mined_total', 'Blocks mined by this node')
+SIGNATURE_VERIFICATIONS = registry.counter('signature_verifications_total', 'Signature checks by result and cache use')
+VERIFIED_CACHED = {is_valid: SIGNATURE_VERIFICATIONS.labels(result='valid' if is_valid else 'invalid', cache='hit')
+                   for is_valid in (True, False)}
+VERIFIED_UNCACHED = {is_valid: SIGNATURE_VERIFICATIONS.labels(result='valid' if is_valid else 'invalid', cache='miss')
+                     for is_valid in (True, False)}
+SIGNATURE_VERIFY_SECONDS = registry.histogram('signature_verify_seconds', 'Time to check one uncached signature',
+                                              buckets=(0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.005, 0.01))
+COMPACT_BLOCK_MISSING = registry.counter('compact_block_missing_transactions_total',
+                                         'Transactions of compact blocks that were not in the mempool')
+DUPLICATE_TRANSACTIONS = registry.counter('duplicate_transactions_total',
+                                          'Transactions dropped because this node had already seen them')
+BALANCE_CHECK_SECONDS = registry.histogram('balance_check_seconds', 'Time to check the balances of a block',
+                                           buckets=(0.00001, 0.0001, 0.001, 0.01, 0.1, 1))
+
 
 class Block:
-    def __init__(self, prev_block: Union[Block, None], transactions: List[Transaction], reward: int, difficulty: int):
+    def __init__(self, prev_block: Union[Block, None], transactions: List[Transaction], reward: int, difficulty: int,
+                 version: int = BLOCK_VERSION_HEADER):
         self.prev_block = prev_block
         self.next_block = None
         self.transactions = transactions
         self.reward = reward
         self.difficulty = difficulty
+        self.version = version
+        self.timestamp = time.time()
+        self.merkle_root = ""
         self.nonce = 0
         self.block_hash = "0x0"
         self.transactions.sort(key=lambda x: x.ts)
         self.coin_base_transaction = None
+        self.hash_rate = 0.0
 
-    def mine(self, miner_addr: PublicKey):
+    def mine(self, miner_addr: PublicKey, balances: Dict[str, int] = None, workers: int = 1,
+             verify_workers: int = VERIFY_WORKERS, job: MiningJob = None):
         start_time = time.time()
         coinbase_transaction = self._generate_coinbase_transaction(self.reward, miner_addr)
-        self.verify_valid_transactions(self.transactions)
+        self.verify_valid_transactions(self.transactions, balances, verify_workers)
+        binary_nonce = self.version != BLOCK_VERSION_LEGACY
+        if binary_nonce:
+            self.timestamp = start_time
+            self.merkle_root = block_merkle_root(self.transactions, coinbase_transaction)
+            prefix = self.header().prefix()
+        else:
+            prefix = block_prefix(self.prev_block.block_hash, self.transactions, coinbase_transaction)
+        if workers > 1:
+            self.nonce, self.block_hash, hashes = parallel_mine(prefix, self.difficulty, workers,
+                                                                binary_nonce=binary_nonce, job=job)
+        else:
+            hashes = self._mine_sequential(PrefixHasher(prefix, binary_nonce), job)
+        time_cost = time.time() - start_time
+        self.hash_rate = hash_rate(hashes, time_cost)
+        MINING_DURATION.observe(time_cost)
+        MINING_HASH_RATE.set(self.hash_rate)
+        logging.info(f"Block hash {self.block_hash}, mined time cost {time_cost}, "
+                     f"workers {workers}, hash rate {self.hash_rate:.0f}/s")
+
+    def _mine_sequential(self, hasher: PrefixHasher, job: MiningJob = None) -> int:
+        start_nonce = self.nonce
         while 1:
-            block_hash = hash_block(
-                self.prev_block.block_hash,
-                self.transactions,
-                coinbase_transaction,
-                self.nonce
-            )
-            if self._valid_block_hash(block_hash):
-                time_cost = time.time() - start_time
+            nonce, block_hash = hasher.search(self.nonce, self.nonce + CHUNK_SIZE, self.difficulty)
+            if nonce >= 0:
+                self.nonce = nonce
                 self.block_hash = block_hash
-                logging.info(f"Block hash {self.block_hash}, mined time cost {time_cost}")
-                break
-            else:
-                self.nonce += 1
+                return self.nonce - start_nonce + 1
+            self.nonce += CHUNK_SIZE
+            if job is not None:
+                if job.cancelled:
+                    raise MiningCancelledException(f"Mining job {job.id} cancelled")
+                job.progress(self.nonce - start_nonce)
 
     def _generate_coinbase_transaction(self, reward: int, miner_addr: PublicKey) -> Transaction:
         # coinbase transaction does not need a signature
@@ -53,19 +124,30 @@ class Block:
                 from_addr=GenesisPublicKey(None),
                 to_addr=miner_addr,
                 amount=reward,
+                ts=time.time()
             )
         return self.coin_base_transaction
 
+    def header(self) -> BlockHeader:
+        return BlockHeader(
+            prev_hash=self.prev_block.block_hash if self.prev_block else "",
+            merkle_root=self.merkle_root,
+            difficulty=self.difficulty,
+            timestamp=self.timestamp,
+            nonce=self.nonce,
+            version=self.version
+        )
+
     def _valid_block_hash(self, block_hash: str):
         return block_hash[:self.difficulty] == "0" * self.difficulty
 
-    def verify_valid_transactions(self, transactions: List[Transaction]):
-        for txn in transactions:
-            self.verify_single_transaction(txn)
-
-    def verify_single_transaction(self, txn: Transaction):
-        self.verify_signature(txn)
-        verify_transaction_has_sufficient_funds(self, txn)
+    def verify_valid_transactions(self, transactions: List[Transaction], balances: Dict[str, int] = None,
+                                  verify_workers: int = VERIFY_WORKERS):
+        verify_signatures(transactions, verify_workers)
+        # balances is the account state at prev_block, rebuilt from the ancestors when not given
+        if balances is None:
+            balances = compute_balances(self.prev_block)
+        verify_balances(balances, transactions)
 
     def verify_signature(self, txn: Transaction):
         public_key: PublicKey = txn.from_addr
@@ -77,6 +159,113 @@ class Block:
         if self.reward != other.reward:
             raise ValueError(f"Invalid reward for miner, expecting {self.reward} got {other.reward}")
 
+    def to_dict(self) -> Dict:
+        return {
+            'block_hash': self.block_hash,
+            'prev_hash': self.prev_block.block_hash if self.prev_block else None,
+            'nonce': self.nonce,
+            'reward': self.reward,
+            'difficulty': self.difficulty,
+            'version': self.version,
+            'timestamp': self.timestamp,
+            'merkle_root': self.merkle_root,
+            'transactions': [transaction_to_dict(txn) for txn in self.transactions],
+            'coinbase': transaction_to_dict(self.coin_base_transaction) if self.coin_base_transaction else None
+        }
+
+    def _fields_to_bytes(self, block_format: int) -> bytes:
+        prev_hash = self.prev_block.block_hash if self.prev_block else ""
+        return BLOCK_FIELDS.pack(
+            block_format,
+            self.nonce,
+            self.reward,
+            self.difficulty,
+            self.coin_base_transaction is not None,
+            self.version,
+            self.timestamp
+        ) + pack_str(prev_hash) + pack_str(self.block_hash) + pack_str(self.merkle_root)
+
+    def to_bytes(self) -> bytes:
+        data = self._fields_to_bytes(BLOCK_FORMAT) + transactions_to_bytes(self.transactions)
+        if self.coin_base_transaction is not None:
+            data += transaction_to_bytes(self.coin_base_transaction)
+        return data
+
+    def to_compact_bytes(self) -> bytes:
+        # the transactions are replaced by their short ids, peers rebuild them from their mempool
+        data = self._fields_to_bytes(COMPACT_BLOCK_FORMAT) \
+            + short_ids_to_bytes([short_id(txn.txid) for txn in self.transactions])
+        if self.coin_base_transaction is not None:
+            data += transaction_to_bytes(self.coin_base_transaction)
+        return data
+
+    @classmethod
+    def from_bytes(cls, data: bytes, prev_block: Union[Block, None]) -> Block:
+        block_format = data[0]
+        if block_format != BLOCK_FORMAT:
+            raise ValueError(f"Unknown block format {block_format}")
+        _, nonce, reward, difficulty, has_coinbase, version, timestamp = BLOCK_FIELDS.unpack_from(data, 0)
+        prev_hash, offset = unpack_str(data, BLOCK_FIELDS.size)
+        block_hash, offset = unpack_str(data, offset)
+        merkle_root_hex, offset = unpack_str(data, offset)
+        transactions, offset = transactions_from_bytes(data, offset)
+        expected_prev_hash = prev_block.block_hash if prev_block else ""
+        if prev_hash != expected_prev_hash:
+            raise ValueError(f"Block {block_hash} does not extend {expected_prev_hash}")
+        block = cls(prev_block=prev_block, transactions=transactions, reward=reward, difficulty=difficulty,
+                    version=version)
+        block.timestamp = timestamp
+        block.merkle_root = merkle_root_hex
+        block.nonce = nonce
+        block.block_hash = block_hash
+        if has_coinbase:
+            block.coin_base_transaction, _ = transaction_from_bytes(data, offset)
+        return block
+
+    @classmethod
+    def from_compact_bytes(cls, data: bytes, prev_block: Block,
+                           lookup: Callable[[bytes], Union[Transaction, None]]) -> Tuple[Union[Block, None], List[int]]:
+        """
+        Rebuild a block from its compact encoding, taking each transaction from the ones sent along
+        with it or else from lookup by short id.
+        Returns the block and an empty list, or None and the indexes of the transactions to ask for.
+        """
+        if data[0] != COMPACT_BLOCK_FORMAT:
+            raise ValueError(f"Unknown compact block format {data[0]}")
+        _, nonce, reward, difficulty, has_coinbase, version, timestamp = BLOCK_FIELDS.unpack_from(data, 0)
+        prev_hash, offset = unpack_str(data, BLOCK_FIELDS.size)
+        block_hash, offset = unpack_str(data, offset)
+        merkle_root_hex, offset = unpack_str(data, offset)
+        ids, offset = short_ids_from_bytes(data, offset)
+        # only mined blocks are relayed, and every mined block has a coinbase
+        if not has_coinbase:
+            raise ValueError(f"Block {block_hash} has no coinbase transaction")
+        coinbase, offset = transaction_from_bytes(data, offset)
+        sent = {}
+        if offset < len(data):
+            sent, _ = indexed_transactions_from_bytes(data, offset)
+        if prev_hash != prev_block.block_hash:
+            raise ValueError(f"Block {block_hash} does not extend {prev_block.block_hash}")
+
+        transactions = [sent.get(i) or lookup(sid) for i, sid in enumerate(ids)]
+        missing = [i for i, txn in enumerate(transactions) if txn is None]
+        if not missing and version != BLOCK_VERSION_LEGACY \
+                and block_merkle_root(transactions, coinbase) != merkle_root_hex:
+            # a short id matched the wrong pending transaction, ask for every one not sent yet;
+            # once all of them were sent a mismatch is left to block verification
+            missing = [i for i in range(len(ids)) if i not in sent]
+        if missing:
+            return None, missing
+
+        block = cls(prev_block=prev_block, transactions=transactions, reward=reward, difficulty=difficulty,
+                    version=version)
+        block.timestamp = timestamp
+        block.merkle_root = merkle_root_hex
+        block.nonce = nonce
+        block.block_hash = block_hash
+        block.coin_base_transaction = coinbase
+        return block, []
+
     def verify_correct_transactions(self, other: Block):
         self.verify_transaction_fields(other.transactions)
         self.verify_valid_transactions(other.transactions)
@@ -96,45 +285,356 @@ class BlockChain:
     2. add and validate a new block
     """
 
-    def __init__(self, chain: List[Block], reward: int, difficulty: int, peers: List[Tuple] = None):
+    def __init__(self, chain: List[Block], reward: int, difficulty: int, peers: List[Tuple] = None,
+                 mining_workers: int = 1, verify_workers: int = VERIFY_WORKERS,
+                 mempool_max_count: int = DEFAULT_MAX_COUNT, mempool_max_bytes: int = DEFAULT_MAX_BYTES,
+                 store=None):
         self.reward = reward
         self.difficulty = difficulty
-        self.pending_transactions: List[Transaction] = []
+        self.mining_workers = mining_workers
+        self.verify_workers = verify_workers
+        self.mempool = Mempool(max_count=mempool_max_count, max_bytes=mempool_max_bytes)
         self.chain: List[Block] = chain
+        # guards the chain tip, mining threads and request handlers add blocks concurrently
+        self._lock = threading.RLock()
+        self.mining_jobs: OrderedDict = OrderedDict()
         self.peers: List = peers if peers else []
+        self.broadcaster = Broadcaster(self.peers)
+        # optional block_store.BlockStore, every added block is appended to it
+        self.store = store
+        # account state at the tip of the chain, updated once per appended block
+        self.balances: Dict[str, int] = compute_balances(chain[-1] if chain else None)
+        # txid -> (height, position in block), the coinbase sits after the block's transactions
+        self.transaction_index: Dict[str, Tuple[int, int]] = {}
+        # block hash -> height, the chain list itself is the height index
+        self.block_index: Dict[str, int] = {}
+        # address -> postings (height, position, txid, balance change) in chain order
+        self.address_index: Dict[str, List[Tuple[int, int, str, int]]] = {}
+        # txid -> time this node first accepted the transaction
+        self.seen_at = LRUCache(SEEN_CACHE_SIZE)
+        # block hash -> time this node appended the block
+        self.block_received: Dict[str, float] = {}
+        for height, block in enumerate(chain):
+            self._index_block(height, block)
+
+    @property
+    def pending_transactions(self) -> List[Transaction]:
+        return self.mempool.transactions()
+
+    def seen(self, txid: str) -> bool:
+        # recently accepted or confirmed, either way a copy relayed back by a peer is an echo
+        return txid in self.seen_at or txid in self.transaction_index
+
+    def add_transaction(self, transaction: Transaction, hop_limit: int = HOP_LIMIT) -> bool:
+        """
+        Add a transaction to the mempool and relay it while hop_limit allows.
+        Returns False for transactions already seen, including confirmed ones mined out of the mempool.
+        """
+        txid = transaction.txid
+        # under the chain lock, so a block confirming the transaction cannot land between the check and the add
+        with self._lock:
+            if self.seen(txid) or not self.mempool.add(transaction):
+                DUPLICATE_TRANSACTIONS.inc()
+                return False
+            self.seen_at.put(txid, time.time())
+        if hop_limit > 0:
+            self.broadcast_transaction(transaction, hop_limit - 1)
+        return True
 
-    def add_transaction(self, transaction: Transaction):
-        print("pending transaction len", len(self.pending_transactions))
-        for current_txn in self.pending_transactions:
-            if transaction == current_txn:
-                return
-        self.pending_transactions.append(transaction)
-        self.broadcast_transaction(transaction)
-
-    def mine(self, miner_addr: PublicKey):
-        last_block = self.chain[-1]
-        block_new = Block(
-            prev_block=last_block,
-            transactions=self.pending_transactions,
-            reward=self.reward,
-            difficulty=self.difficulty
-        )
-        try:
-            block_new.mine(miner_addr)
-            self.add_block(block_new, need_verify=False)
-            self.pending_transactions = []
-        except Exception as e:
-            print(f"Failed to mine {e}")
+    def add_transactions(self, transactions: List[Transaction], hop_limit: int = HOP_LIMIT) -> List[str]:
+        """
+        Verify a batch of transactions together and add the valid ones.
+        Returns the status of each transaction: accepted, duplicate or invalid_signature.
+        """
+        # duplicates are dropped before their signatures are checked
+        fresh = [txn for txn in transactions if not self.seen(txn.txid)]
+        invalid = {id(txn) for txn in verify_batch(fresh, self.verify_workers)}
+        results = []
+        for txn in transactions:
+            if id(txn) in invalid:
+                results.append('invalid_signature')
+            elif self.add_transaction(txn, hop_limit):
+                results.append('accepted')
+            else:
+                results.append('duplicate')
+        return results
 
-    def add_block(self, block: Block, need_verify=False):
+    def mine(self, miner_addr: PublicKey, workers: int = None, job: MiningJob = None) -> Union[Block, None]:
+        while 1:
+            with self._lock:
+                last_block = self.chain[-1]
+                balances = dict(self.balances)
+                block_new = Block(
+                    prev_block=last_block,
+                    transactions=self.pending_transactions,
+                    reward=self.reward,
+                    difficulty=self.difficulty
+                )
+            if job is not None:
+                job.prev_hash = last_block.block_hash
+                job.status = 'running'
+            try:
+                block_new.mine(miner_addr, balances, workers or self.mining_workers, self.verify_workers, job)
+                with self._lock:
+                    if self.chain[-1] is not last_block:
+                        raise MiningCancelledException(f"Chain tip changed while mining on {last_block.block_hash}")
+                    self.add_block(block_new, need_verify=False, mined_by=job)
+                    BLOCKS_MINED.inc()
+                self.broadcast_block(block_new)
+            except MiningCancelledException as e:
+                print(f"Mining cancelled {e}")
+                if job is not None:
+                    job.finish('cancelled', error=str(e))
+                return None
+            except Exception as e:
+                # one bad pending transaction must not block mining, drop the ones that can never be mined and retry
+                if isinstance(e, (InvalidSignatureException, InsufficientFundsException)) \
+                        and self._drop_unmineable(block_new.transactions, balances, e):
+                    print(f"Dropped pending transactions that cannot be mined {e}")
+                    continue
+                print(f"Failed to mine {e}")
+                if job is not None:
+                    job.finish('failed', error=str(e))
+                return None
+            break
+        if job is not None:
+            job.progress(max(job.nonces_tried, block_new.nonce + 1))
+            job.hash_rate = block_new.hash_rate
+            job.finish('succeeded', block_hash=block_new.block_hash)
+        return block_new
+
+    def _drop_unmineable(self, transactions: List[Transaction], balances: Dict[str, int], error: Exception) -> int:
+        """
+        Remove the transactions with invalid signatures and, in timestamp order, the ones the
+        balances cannot cover from the mempool. Returns how many were removed.
+        """
+        invalid = {txn.txid for txn in getattr(error, 'invalid_transactions', [])}
+        dropped = []
+        underfunded = []
+        delta: Dict[str, int] = {}
+        for txn in sorted(transactions, key=lambda x: x.ts):
+            if txn.txid in invalid:
+                dropped.append(txn)
+                continue
+            try:
+                verify_sufficient_balance(balances, delta, txn)
+            except InsufficientFundsException:
+                underfunded.append(txn)
+                continue
+            apply_transaction(delta, txn)
+        with self._lock:
+            self.mempool.remove_transactions(dropped + underfunded)
+            # a transfer that was only early can be sent again once the sender is funded,
+            # forged ones stay seen so their echoes keep being dropped
+            for txn in underfunded:
+                self.seen_at.pop(txn.txid)
+        return len(dropped) + len(underfunded)
+
+    def start_mining(self, miner_addr: PublicKey, workers: int = None) -> MiningJob:
+        """
+        Mine the pending transactions on a background thread, the job is cancelled once the tip changes.
+        workers can only lower the node's mining_workers, and only one job runs per tip.
+        """
+        if workers is not None:
+            workers = max(1, min(workers, self.mining_workers))
+        with self._lock:
+            tip_hash = self.chain[-1].block_hash
+            for running in self.mining_jobs.values():
+                if not running.done and running.prev_hash == tip_hash:
+                    raise MiningInProgressException(f"Mining job {running.id} is already running on {tip_hash}",
+                                                    running)
+            job = MiningJob(tip_hash)
+            self.mining_jobs[job.id] = job
+            while len(self.mining_jobs) > MAX_MINING_JOBS:
+                self.mining_jobs.popitem(last=False)
+        threading.Thread(target=self.mine, args=(miner_addr, workers, job), daemon=True).start()
+        return job
+
+    def _cancel_stale_jobs(self, tip_hash: str, mined_by: MiningJob = None):
+        for job in list(self.mining_jobs.values()):
+            if job is not mined_by and not job.done and job.prev_hash != tip_hash:
+                job.cancel()
+
+    def add_block(self, block: Block, need_verify=False, mined_by: MiningJob = None):
         if need_verify:
             try:
                 self.verify_block(block)
             except Exception as e:
                 print(f"Invalid block {e}")
+        with self._lock:
+            self._append_block(block)
+            self._cancel_stale_jobs(block.block_hash, mined_by)
+
+    def receive_block(self, payload: bytes, hop_limit: int = HOP_LIMIT) -> str:
+        """
+        Add a block relayed by a peer when it extends the tip, then relay it further while hop_limit allows.
+        Returns accepted, duplicate or orphan (it does not extend the tip), raises for invalid blocks.
+        """
+        prev_hash, block_hash = block_hashes(payload)
+        with self._lock:
+            if block_hash in self.block_index:
+                return 'duplicate'
+            if prev_hash != self.chain[-1].block_hash:
+                return 'orphan'
+            block = Block.from_bytes(payload, self.chain[-1])
+            self.verify_block(block)
+            self.add_block(block)
+        if hop_limit > 0:
+            self.broadcast_block(block, hop_limit - 1)
+        return 'accepted'
+
+    def receive_compact_block(self, payload: bytes, hop_limit: int = HOP_LIMIT) -> Tuple[str, List[int]]:
+        """
+        Add a block announced by short transaction ids, rebuilt from the mempool and the transactions sent with it.
+        Returns the status (accepted, duplicate, orphan or missing) and for missing the indexes of the
+        transactions the sender has to send, raises for invalid blocks.
+        """
+        prev_hash, block_hash = block_hashes(payload)
+        with self._lock:
+            if block_hash in self.block_index:
+                return 'duplicate', []
+            if prev_hash != self.chain[-1].block_hash:
+                return 'orphan', []
+            block, missing = Block.from_compact_bytes(payload, self.chain[-1], self.mempool.get_by_short_id)
+            if block is None:
+                COMPACT_BLOCK_MISSING.inc(len(missing))
+                return 'missing', missing
+            self.verify_block(block)
+            self.add_block(block)
+        if hop_limit > 0:
+            self.broadcast_block(block, hop_limit - 1)
+        return 'accepted', []
+
+    def _append_block(self, block: Block):
         last_block = self.chain[-1]
         last_block.next_block = block
         self.chain.append(block)
+        self._index_block(len(self.chain) - 1, block)
+        self.block_received[block.block_hash] = time.time()
+        if self.store is not None:
+            self.store.append(block)
+        apply_transactions(self.balances, block.transactions)
+        self.mempool.remove_transactions(block.transactions)
+
+    def _index_block(self, height: int, block: Block):
+        self.block_index[block.block_hash] = height
+        for position, txn in enumerate(block_transactions(block)):
+            txid = txn.txid
+            self.transaction_index[txid] = (height, position)
+            # coinbase rewards do not move balances, so they get no postings
+            if txn is block.coin_base_transaction:
+                continue
+            self.address_index.setdefault(address_of(txn.from_addr), []).append((height, position, txid, -txn.amount))
+            self.address_index.setdefault(address_of(txn.to_addr), []).append((height, position, txid, txn.amount))
+
+    def block_by_hash(self, block_hash: str) -> Union[Block, None]:
+        height = self.block_index.get(block_hash)
+        return None if height is None else self.chain[height]
+
+    def transaction_status(self, txid: str) -> Dict:
+        status = {'txid': txid, 'received_at': self.seen_at.get(txid)}
+        if txid in self.transaction_index:
+            height, position = self.transaction_index[txid]
+            return dict(status, status='confirmed', height=height, block_hash=self.chain[height].block_hash)
+        if txid in self.mempool:
+            return dict(status, status='pending')
+        return dict(status, status='unknown')
+
+    def block_at(self, height: int) -> Union[Block, None]:
+        return self.chain[height] if 0 <= height < len(self.chain) else None
+
+    def balance_of(self, address: str) -> int:
+        return self.balances.get(address, 0)
+
+    def history(self, address: str, page: int = 0, page_size: int = 50) -> List[Dict]:
+        """
+        Postings of an address, newest first, page is 0 based.
+        """
+        postings = self.address_index.get(address, [])
+        end = len(postings) - page * page_size
+        start = max(end - page_size, 0)
+        return [
+            {'height': height, 'position': position, 'txid': txid, 'amount': amount}
+            for height, position, txid, amount in reversed(postings[start:max(end, 0)])
+        ]
+
+    def merkle_proof(self, txid: str) -> Dict:
+        """
+        Header of the block holding txid and the Merkle path from the transaction to its root.
+        """
+        height, position = self.transaction_index[txid]
+        block = self.chain[height]
+        # legacy blocks and the unmined genesis block commit to no merkle root
+        if block.version == BLOCK_VERSION_LEGACY or not block.merkle_root:
+            raise ValueError(f"Block {block.block_hash} at height {height} has no merkle root")
+        leaves = [bytes.fromhex(txn.txid) for txn in block_transactions(block)]
+        return {
+            'txid': txid,
+            'height': height,
+            'header': block.header().to_dict(),
+            'proof': merkle_proof(leaves, position)
+        }
+
+    def headers(self, start: int, count: int) -> List[Dict]:
+        return [block.header().to_dict() for block in self.chain[start:start + count]]
+
+    def validate_chain(self, checkpoints: List[int] = None, workers: int = None) -> int:
+        """
+        Validate the whole chain after the highest trusted checkpoint height.
+        Links, difficulty and reward are checked first, then hashes, merkle roots, proof of work against
+        the chain difficulty and all signatures in a process pool, balances in one sequential pass afterwards.
+        Returns the number of blocks validated.
+        """
+        with self._lock:
+            chain = list(self.chain)
+        trusted = max([height for height in (checkpoints or []) if 0 <= height < len(chain)], default=0)
+        blocks = list(enumerate(chain))[trusted + 1:]
+        for height, block in blocks:
+            if block.prev_block is not chain[height - 1] or chain[height - 1].next_block is not block:
+                raise ValueError(f"Broken link at height {height}")
+            if block.coin_base_transaction is None:
+                raise ValueError(f"Missing coinbase transaction at height {height}")
+            if block.difficulty != self.difficulty:
+                raise ValueError(f"Wrong difficulty at height {height}, expected difficulty {self.difficulty} "
+                                 f"got difficulty {block.difficulty}")
+            if block.reward != self.reward or block.coin_base_transaction.amount != self.reward:
+                raise ValueError(f"Invalid reward for miner at height {height}, expecting {self.reward} "
+                                 f"got {block.reward}")
+
+        hash_jobs = [_hash_job(height, block, self.difficulty) for height, block in blocks]
+        signature_jobs = [
+            (height, txn.from_addr.to_bytes(), txn.encode(), txn.signature)
+            for height, block in blocks for txn in block.transactions
+        ]
+        workers = workers or self.verify_workers
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and blocks else None
+        try:
+            hash_results = submit(check_hash, hash_jobs, pool)
+            signature_results = submit(check_signature, signature_jobs, pool)
+            for error in hash_results:
+                if error is not None:
+                    raise ValueError(error)
+            invalid_transactions = [
+                job for job, is_valid in zip(signature_jobs, signature_results) if not is_valid
+            ]
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        if invalid_transactions:
+            raise InvalidSignatureException(
+                f"{len(invalid_transactions)} invalid transactions, first at height {invalid_transactions[0][0]}",
+                invalid_transactions
+            )
+
+        balances = compute_balances(chain[trusted])
+        for height, block in blocks:
+            try:
+                delta = verify_balances(balances, block.transactions)
+            except InsufficientFundsException as e:
+                raise InsufficientFundsException(f"Height {height}: {e}")
+            for address, change in delta.items():
+                balances[address] = balances.get(address, 0) + change
+        return len(blocks)
 
     def verify_block(self, other: Block):
         self.verify_correct_reward(other)
@@ -149,12 +649,18 @@ class BlockChain:
         self.verify_valid_transactions(other)
 
     def verify_block_hash(self, other: Block):
-        calculated_hash = hash_block(
-            prev_hash=other.prev_block.block_hash,
-            transactions=other.transactions,
-            coinbase_transaction=other.coin_base_transaction,
-            nonce=other.nonce
-        )
+        if other.version == BLOCK_VERSION_LEGACY:
+            calculated_hash = hash_block(
+                prev_hash=other.prev_block.block_hash,
+                transactions=other.transactions,
+                coinbase_transaction=other.coin_base_transaction,
+                nonce=other.nonce
+            )
+        else:
+            calculated_root = block_merkle_root(other.transactions, other.coin_base_transaction)
+            if other.merkle_root != calculated_root:
+                raise ValueError(f"Wrong merkle root, expected {calculated_root} got {other.merkle_root}")
+            calculated_hash = other.header().hash()
         if other.block_hash != calculated_hash:
             raise ValueError(f"Wrong block hash, expected hash {calculated_hash} got hash {other.block_hash}")
 
@@ -167,13 +673,14 @@ class BlockChain:
             raise ValueError(f"Wrong block {other.block_hash} with difficulty {self.difficulty}")
 
     def verify_valid_transactions(self, block: Block):
-        transactions = block.transactions
-        for txn in transactions:
-            self.verify_single_transaction(block, txn)
+        verify_signatures(block.transactions, self.verify_workers)
+        verify_balances(self.balances_at(block.prev_block), block.transactions)
 
-    def verify_single_transaction(self, block: Block, txn: Transaction):
-        self.verify_signature(txn)
-        verify_transaction_has_sufficient_funds(block, txn)
+    def balances_at(self, block: Union[Block, None]) -> Dict[str, int]:
+        if self.chain and block is self.chain[-1]:
+            return self.balances
+        # block forks off an older ancestor, fall back to a full walk
+        return compute_balances(block)
 
     @staticmethod
     def verify_signature(txn: Transaction):
@@ -185,34 +692,96 @@ class BlockChain:
     def add_peer(self, peer: Tuple):
         self.peers.append(peer)
 
-    def broadcast_transaction(self, transaction: Transaction):
-        print('peers', self.peers)
-        for peer in self.peers:
-            host, port = peer[0], peer[1]
-            print("broadcasting transaction", host, port)
-            add_transaction(
-                host=host,
-                port=port,
-                sender=str(transaction.from_addr),
-                receiver=str(transaction.to_addr),
-                amount=transaction.amount,
-                signature=transaction.signature)
+    def broadcast_transaction(self, transaction: Transaction, hop_limit: int = HOP_LIMIT):
+        # queued and sent by background threads, never blocks the caller
+        self.broadcaster.submit(transaction, hop_limit)
+
+    def broadcast_block(self, block: Block, hop_limit: int = HOP_LIMIT):
+        # peers get the compact encoding and ask for the transactions they do not have
+        self.broadcaster.submit_block(BlockRelay(block.to_compact_bytes(), block.transactions), hop_limit)
 
 
 def verify(public_key: PublicKey, transaction: Transaction) -> bool:
-    try:
-        public_key.public_key.verify(
-            signature=transaction.signature,
-            data=transaction.encode(),
-            padding=padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            algorithm=hashes.SHA256()
+    data = transaction.encode()
+    cache_key = hashlib.sha256(public_key.to_bytes() + data + transaction.signature).digest()
+    is_valid = signature_cache.get(cache_key)
+    if is_valid is not None:
+        VERIFIED_CACHED[is_valid].inc()
+        return is_valid
+    start = time.perf_counter()
+    is_valid = public_key.verify(data, transaction.signature)
+    SIGNATURE_VERIFY_SECONDS.observe(time.perf_counter() - start)
+    VERIFIED_UNCACHED[is_valid].inc()
+    signature_cache.put(cache_key, is_valid)
+    return is_valid
+
+
+def signature_cache_info() -> Dict[str, int]:
+    return signature_cache.info()
+
+
+def verify_batch(transactions: List[Transaction], workers: int = VERIFY_WORKERS) -> List[Transaction]:
+    """
+    Verify the signatures of all transactions, concurrently when workers > 1.
+    Returns every transaction with an invalid signature.
+    """
+    if workers <= 1 or len(transactions) <= 1:
+        results = [verify(txn.from_addr, txn) for txn in transactions]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(transactions))) as pool:
+            results = list(pool.map(lambda txn: verify(txn.from_addr, txn), transactions))
+    return [txn for txn, is_valid in zip(transactions, results) if not is_valid]
+
+
+def verify_signatures(transactions: List[Transaction], workers: int = VERIFY_WORKERS):
+    invalid_transactions = verify_batch(transactions, workers)
+    if invalid_transactions:
+        raise InvalidSignatureException(
+            f"{len(invalid_transactions)} invalid transactions, first {invalid_transactions[0]}",
+            invalid_transactions
         )
-        return True
-    except InvalidSignature:
-        return False
+
+
+def _hash_job(height: int, block: Block, difficulty: int) -> Tuple:
+    # proof of work is checked against the chain difficulty, never the one the block declares
+    if block.version == BLOCK_VERSION_LEGACY:
+        prefix = block_prefix(block.prev_block.block_hash, block.transactions, block.coin_base_transaction)
+        return height, prefix, block.nonce, False, block.block_hash, difficulty, "", []
+    leaves = [bytes.fromhex(txn.txid) for txn in block_transactions(block)]
+    return height, block.header().prefix(), block.nonce, True, block.block_hash, difficulty, \
+        block.merkle_root, leaves
+
+
+def block_hashes(payload: bytes) -> Tuple[str, str]:
+    # (prev hash, block hash) of an encoded block without decoding its transactions
+    block_format = payload[0]
+    if block_format not in (BLOCK_FORMAT, COMPACT_BLOCK_FORMAT):
+        raise ValueError(f"Unknown block format {block_format}")
+    prev_hash, offset = unpack_str(payload, BLOCK_FIELDS.size)
+    block_hash, _ = unpack_str(payload, offset)
+    return prev_hash, block_hash
+
+
+def block_transactions(block: Block) -> List[Transaction]:
+    # the transactions a block commits to, coinbase last
+    if block.coin_base_transaction is None:
+        return list(block.transactions)
+    return block.transactions + [block.coin_base_transaction]
+
+
+def block_merkle_root(transactions: List[Transaction], coinbase_transaction: Transaction) -> str:
+    leaves = [bytes.fromhex(txn.txid) for txn in transactions + [coinbase_transaction]]
+    return merkle_root(leaves).hex()
+
+
+def block_prefix(prev_hash: str, transactions: List[Transaction], coinbase_transaction: Transaction) -> bytes:
+    # everything hash_block covers except the nonce
+    return prev_hash.encode() + b"".join(txn.hash_bytes() for txn in transactions + [coinbase_transaction])
+
+
+def mining_hasher(prev_hash: str, transactions: List[Transaction], coinbase_transaction: Transaction) -> PrefixHasher:
+    # produces the same digests as hash_block for every nonce
+    return PrefixHasher(block_prefix(prev_hash, transactions, coinbase_transaction))
 
 
 def hash_block(
@@ -220,39 +789,69 @@ def hash_block(
         transactions: List[Transaction],
         coinbase_transaction: Transaction,
         nonce: int) -> str:
-    encode_str = prev_hash
-    for txn in transactions + [coinbase_transaction]:
-        encode_str += str(txn)
-    encode_str += str(nonce)
-    encode_str = encode_str.encode()
+    encode_str = block_prefix(prev_hash, transactions, coinbase_transaction) + str(nonce).encode()
     return hashlib.sha256(encode_str).hexdigest()
 
 
-def verify_transaction_has_sufficient_funds(block: Block, txn: Transaction):
-    from_addr = txn.from_addr
-    amount = txn.amount
-    balance = 0
-    transactions = block.transactions
+def address_of(public_key: PublicKey) -> str:
+    return public_key.fingerprint
 
-    i = 0
-    # transactions are already sorted
-    while transactions[i] != txn:
-        if transactions[i].from_addr == from_addr:
-            balance -= transactions[i].amount
-        if transactions[i].to_addr == from_addr:
-            balance += transactions[i].amount
-        i += 1
-
-    node: Block = block.prev_block
+
+def apply_transaction(balances: Dict[str, int], txn: Transaction):
+    from_addr = address_of(txn.from_addr)
+    to_addr = address_of(txn.to_addr)
+    balances[from_addr] = balances.get(from_addr, 0) - txn.amount
+    balances[to_addr] = balances.get(to_addr, 0) + txn.amount
+
+
+def apply_transactions(balances: Dict[str, int], transactions: List[Transaction]):
+    for txn in transactions:
+        apply_transaction(balances, txn)
+
+
+def compute_balances(block: Union[Block, None]) -> Dict[str, int]:
+    # walks block and all of its ancestors once
+    balances: Dict[str, int] = {}
+    node = block
     while node:
-        for txn in node.transactions:
-            if txn.from_addr == from_addr:
-                balance -= txn.amount
-            if txn.to_addr == from_addr:
-                balance += txn.amount
+        apply_transactions(balances, node.transactions)
         node = node.prev_block
-    if balance < amount:
-        raise InsufficientFundsException(f"transfer amount {amount}, got balance {balance}")
+    return balances
+
+
+def verify_balances(balances: Dict[str, int], transactions: List[Transaction]) -> Dict[str, int]:
+    """
+    Check the transactions of one block in timestamp order against balances.
+    Returns the balance changes they make.
+    """
+    start = time.perf_counter()
+    delta: Dict[str, int] = {}
+    try:
+        for txn in sorted(transactions, key=lambda x: x.ts):
+            verify_sufficient_balance(balances, delta, txn)
+            apply_transaction(delta, txn)
+    finally:
+        BALANCE_CHECK_SECONDS.observe(time.perf_counter() - start)
+    return delta
+
+
+def verify_sufficient_balance(balances: Dict[str, int], delta: Dict[str, int], txn: Transaction):
+    from_addr = address_of(txn.from_addr)
+    balance = balances.get(from_addr, 0) + delta.get(from_addr, 0)
+    if balance < txn.amount:
+        raise InsufficientFundsException(f"transfer amount {txn.amount}, got balance {balance}")
+
+
+def verify_transaction_has_sufficient_funds(block: Block, txn: Transaction, balances: Dict[str, int] = None):
+    if balances is None:
+        balances = compute_balances(block.prev_block)
+    delta: Dict[str, int] = {}
+    # transactions are already sorted
+    for current_txn in block.transactions:
+        if current_txn == txn:
+            break
+        apply_transaction(delta, current_txn)
+    verify_sufficient_balance(balances, delta, txn)
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
-from utils import unpickle_wallets, unpickle_accounts, generate_signed_transaction
+from utils import unpickle_accounts, generate_signed_transaction
+from wallet_pool import load_wallets
 from client_utils import add_transaction, mine_block
 import random
 
@@ -8,7 +9,7 @@ PORT = 5000
 
 if __name__ == '__main__':
     accounts = unpickle_accounts('tmp/accounts')
-    wallets = unpickle_wallets('tmp/wallets')
+    wallets = load_wallets('tmp/wallets')
 
     wa = wallets[0]
     wb = wallets[1]
@@ -18,10 +19,7 @@ if __name__ == '__main__':
     add_transaction(
         host=HOST,
         port=PORT,
-        sender=str(txn.from_addr),
-        receiver=str(txn.to_addr),
-        signature=txn.signature,
-        amount=txn.amount)
+        txn=txn)
 
     mine_block(
         host=HOST,
@@ -1,31 +1,321 @@
 import requests
-import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator, Tuple
+from custom_types import Transaction
+from codec import transaction_to_dict, transactions_to_bytes, indexed_transactions_to_bytes, BLOCK_FRAME
+from header import BlockHeader
+from merkle import verify_merkle_proof
 
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+# peer links a relayed transaction or block may still cross
+HOP_LIMIT_HEADER = 'X-Hop-Limit'
 
-def add_transaction(host: str, port: int, sender: str, receiver: str, signature: bytes, amount: int):
-    data = {
-        "sender": sender,
-        "receiver": receiver,
-        "signature": base64.b64encode(signature).decode('utf-8'),
-        "amount": amount
-    }
+
+TIMEOUT = 10
+
+
+def add_transaction(host: str, port: int, txn: Transaction, session: requests.Session = None,
+                    verbose: bool = True) -> Dict:
+    # version and ts are sent as signed, the node needs both to rebuild the signed payload
+    # returns the node's result, its status is accepted or duplicate
+    data = transaction_to_dict(txn)
     url = host + ":" + str(port) + "/transaction/new"
-    resp: requests.Response = requests.post(url, json=data)
+    resp: requests.Response = (session or requests).post(url, json=data, timeout=TIMEOUT)
     if resp.status_code == 200:
-        print("Successfully added transaction")
+        if verbose:
+            print("Successfully added transaction")
+        return resp.json()
     else:
         print(f"Error adding transaction {resp.text}")
         raise Exception(f"Error adding transaction {resp.text}")
 
 
-def mine_block(host: str, port: int, miner: str):
+def add_transactions(host: str, port: int, transactions: List[Transaction],
+                     session: requests.Session = None, binary: bool = False, hop_limit: int = None) -> List[Dict]:
+    """
+    Submit many signed transactions in one request, returns the node's result for each of them.
+    With binary=True the batch is sent in the compact wire format instead of JSON.
+    Peers relaying the batch pass the hop limit left, clients leave it to the node.
+    """
+    url = host + ":" + str(port) + "/transaction/batch"
+    headers = _hop_limit_headers(hop_limit)
+    if binary:
+        resp: requests.Response = (session or requests).post(
+            url,
+            data=transactions_to_bytes(transactions),
+            headers={'Content-Type': BINARY_CONTENT_TYPE, **headers},
+            timeout=TIMEOUT)
+    else:
+        data = {
+            "transactions": [transaction_to_dict(txn) for txn in transactions]
+        }
+        resp = (session or requests).post(url, json=data, headers=headers, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['results']
+    raise Exception(f"Error adding transactions {resp.text}")
+
+
+def add_block(host: str, port: int, payload: bytes, session: requests.Session = None, hop_limit: int = None) -> str:
+    """
+    Relay an encoded block, returns accepted, duplicate or orphan.
+    """
+    url = host + ":" + str(port) + "/block/new"
+    headers = {'Content-Type': BINARY_CONTENT_TYPE, **_hop_limit_headers(hop_limit)}
+    resp: requests.Response = (session or requests).post(url, data=payload, headers=headers, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['message']['status']
+    raise Exception(f"Error adding block {resp.text}")
+
+
+def add_compact_block(host: str, port: int, payload: bytes, transactions: List[Tuple[int, Transaction]] = None,
+                      session: requests.Session = None, hop_limit: int = None) -> Dict:
+    """
+    Relay a block in its compact encoding together with the transactions the peer asked for by index.
+    Returns the peer's status (accepted, duplicate, orphan or missing) and the indexes it is missing.
+    """
+    url = host + ":" + str(port) + "/block/compact"
+    if transactions:
+        payload += indexed_transactions_to_bytes(transactions)
+    headers = {'Content-Type': BINARY_CONTENT_TYPE, **_hop_limit_headers(hop_limit)}
+    resp: requests.Response = (session or requests).post(url, data=payload, headers=headers, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['message']
+    raise Exception(f"Error adding compact block {resp.text}")
+
+
+def get_transaction_status(host: str, port: int, txid: str, session: requests.Session = None) -> Dict:
+    url = host + ":" + str(port) + "/transaction/" + txid
+    resp: requests.Response = (session or requests).get(url, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['message']
+    if resp.status_code == 404:
+        return {'txid': txid, 'status': 'unknown', 'received_at': None}
+    raise Exception(f"Error getting transaction status {resp.text}")
+
+
+def _hop_limit_headers(hop_limit: int = None) -> Dict[str, str]:
+    return {} if hop_limit is None else {HOP_LIMIT_HEADER: str(hop_limit)}
+
+
+def mine_block(host: str, port: int, miner: str, wait: bool = True, poll_interval: float = 0.2,
+               session: requests.Session = None) -> Dict:
+    """
+    Start a mining job on the node, with wait=True poll it until it finishes.
+    """
     data = {
         "miner_addr": miner
     }
     url = host + ":" + str(port) + "/blockchain/mine"
-    resp: requests.Response = requests.get(url, json=data)
-    if resp.status_code == 200:
-        print(f"Successfully mined transaction {resp.text}")
-    else:
+    resp: requests.Response = (session or requests).get(url, json=data, timeout=TIMEOUT)
+    if resp.status_code != 202:
         raise Exception(f"Error mining transaction {resp.text}")
+    job = resp.json()['message']
+    while wait and job['status'] in ('pending', 'running'):
+        time.sleep(poll_interval)
+        job = get_mining_job(host, port, job['job_id'], session)
+    if job['status'] == 'succeeded':
+        print(f"Successfully mined block {job['block_hash']}")
+    elif wait:
+        raise Exception(f"Error mining transaction {job['status']} {job['error']}")
+    return job
+
+
+def get_mining_job(host: str, port: int, job_id: str, session: requests.Session = None) -> Dict:
+    url = host + ":" + str(port) + "/blockchain/mine/" + job_id
+    resp: requests.Response = (session or requests).get(url, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['message']
+    raise Exception(f"Error getting mining job {resp.text}")
+
+
+def cancel_mining_job(host: str, port: int, job_id: str, session: requests.Session = None) -> Dict:
+    url = host + ":" + str(port) + "/blockchain/mine/" + job_id
+    resp: requests.Response = (session or requests).delete(url, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['message']
+    raise Exception(f"Error cancelling mining job {resp.text}")
+
+
+def get_headers(host: str, port: int, start: int, count: int, session: requests.Session = None) -> List[BlockHeader]:
+    url = host + ":" + str(port) + "/headers"
+    resp: requests.Response = (session or requests).get(url, params={'start': start, 'count': count},
+                                                        timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return [BlockHeader.from_dict(header) for header in resp.json()['message']]
+    raise Exception(f"Error getting headers {resp.text}")
+
+
+def get_merkle_proof(host: str, port: int, txid: str, session: requests.Session = None) -> Dict:
+    url = host + ":" + str(port) + "/transaction/" + txid + "/proof"
+    resp: requests.Response = (session or requests).get(url, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['message']
+    raise Exception(f"Error getting merkle proof {resp.text}")
+
+
+def verify_header_chain(headers: List[BlockHeader], trusted_hash: str, min_difficulty: int = 1) -> bool:
+    """
+    Check that headers link up from the trusted block hash and that each carries valid proof of work.
+    """
+    prev_hash = trusted_hash
+    for header in headers:
+        block_hash = header.hash()
+        if header.prev_hash != prev_hash or header.difficulty < min_difficulty:
+            return False
+        if block_hash[:header.difficulty] != "0" * header.difficulty:
+            return False
+        prev_hash = block_hash
+    return True
+
+
+def verify_transaction_inclusion(txid: str, proof: Dict, headers: List[BlockHeader], first_height: int,
+                                 trusted_hash: str, min_difficulty: int = 1) -> bool:
+    """
+    Light client check that txid is in the chain: headers start at first_height and follow the
+    block with trusted_hash, the proof must lead to the merkle root of the header at its height.
+    """
+    index = proof['height'] - first_height
+    if proof['txid'] != txid or not 0 <= index < len(headers):
+        return False
+    header = headers[index]
+    if BlockHeader.from_dict(proof['header']) != header:
+        return False
+    if not verify_header_chain(headers[:index + 1], trusted_hash, min_difficulty):
+        return False
+    return verify_merkle_proof(bytes.fromhex(txid), proof['proof'], bytes.fromhex(header.merkle_root))
+
+
+def get_chain_info(host: str, port: int, session: requests.Session = None) -> Dict:
+    url = host + ":" + str(port) + "/blockchain/info"
+    resp: requests.Response = (session or requests).get(url, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['message']
+    raise Exception(f"Error getting chain info {resp.text}")
+
+
+def get_block(host: str, port: int, block_hash: str, session: requests.Session = None) -> Dict:
+    """
+    The block with its height and the time the node received it, None when the node does not have it.
+    """
+    url = host + ":" + str(port) + "/block/" + block_hash
+    resp: requests.Response = (session or requests).get(url, timeout=TIMEOUT)
+    if resp.status_code == 200:
+        return resp.json()['message']
+    if resp.status_code == 404:
+        return None
+    raise Exception(f"Error getting block {resp.text}")
+
+
+def get_chain_length(host: str, port: int, session: requests.Session = None) -> int:
+    return get_chain_info(host, port, session)['chain_length']
+
+
+def stream_blocks(host: str, port: int, start: int, count: int, binary: bool = True,
+                  session: requests.Session = None) -> Iterator:
+    """
+    Yield blocks [start, start + count) as they arrive, encoded block bytes when binary
+    else the decoded NDJSON objects.
+    """
+    url = host + ":" + str(port) + "/blocks"
+    params = {'start': start, 'count': count, 'format': 'binary' if binary else 'ndjson'}
+    with (session or requests).get(url, params=params, stream=True, timeout=TIMEOUT) as resp:
+        if resp.status_code != 200:
+            raise Exception(f"Error getting blocks {resp.text}")
+        if not binary:
+            for line in resp.iter_lines():
+                if line:
+                    yield json.loads(line)
+            return
+        while 1:
+            frame = _read_exact(resp.raw, BLOCK_FRAME.size)
+            if not frame:
+                return
+            (length,) = BLOCK_FRAME.unpack(frame)
+            payload = _read_exact(resp.raw, length)
+            if len(payload) != length:
+                raise Exception("Truncated block stream")
+            yield payload
+
+
+def _read_exact(stream, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _chain_length_or_none(host: str, port: int, session: requests.Session):
+    try:
+        return get_chain_length(host, port, session)
+    except Exception as e:
+        print(f"Skipping peer {host}:{port}, chain length unavailable: {e}")
+        return None
+
+
+def sync_chain(blockchain, peers: List[Tuple], batch_size: int = 100, window: int = 4) -> int:
+    """
+    Catch the local chain up with the longest of the peers, peers that do not answer are skipped.
+    Headers are downloaded and checked first, one range ahead of the bodies, then block bodies
+    are fetched concurrently from all peers, at most window ranges in flight. Every block goes
+    through blockchain.verify_block before it is added. Returns the number of blocks added.
+    """
+    # imported here, blockchain_impl itself depends on this module through gossip
+    from blockchain_impl import Block
+
+    sessions = [requests.Session() for _ in peers]
+    try:
+        lengths = [_chain_length_or_none(host, port, session) for (host, port), session in zip(peers, sessions)]
+        target = max((length for length in lengths if length is not None), default=0)
+        start = len(blockchain.chain)
+        if target <= start:
+            return 0
+        # only peers that have the whole range serve bodies, unreachable ones are skipped
+        sources = [i for i, length in enumerate(lengths) if length is not None and length >= target]
+        header_host, header_port = peers[sources[0]]
+        header_session = sessions[sources[0]]
+
+        def fetch_headers(height: int):
+            return get_headers(header_host, header_port, height, min(batch_size, target - height), header_session)
+
+        def fetch_bodies(height: int, source: int) -> List[bytes]:
+            host, port = peers[source]
+            return list(stream_blocks(host, port, height, min(batch_size, target - height), session=sessions[source]))
 
+        added = 0
+        prev_hash = blockchain.chain[-1].block_hash
+        ranges = list(range(start, target, batch_size))
+        with ThreadPoolExecutor(max_workers=len(sources) * window + 1) as pool:
+            headers_future = pool.submit(fetch_headers, ranges[0])
+            bodies = {}
+            for i, height in enumerate(ranges):
+                # keep at most window body ranges in flight
+                for j in range(i, min(i + window, len(ranges))):
+                    if j not in bodies:
+                        bodies[j] = pool.submit(fetch_bodies, ranges[j], sources[j % len(sources)])
+                headers = headers_future.result()
+                if i + 1 < len(ranges):
+                    headers_future = pool.submit(fetch_headers, ranges[i + 1])
+                if not verify_header_chain(headers, prev_hash, min_difficulty=blockchain.difficulty):
+                    raise Exception(f"Invalid headers from {header_host}:{header_port} at height {height}")
+                prev_hash = headers[-1].hash()
+                payloads = bodies.pop(i).result()
+                if len(payloads) != len(headers):
+                    raise Exception(f"Expected {len(headers)} blocks at height {height}, got {len(payloads)}")
+                for header, payload in zip(headers, payloads):
+                    block = Block.from_bytes(payload, blockchain.chain[-1])
+                    if block.block_hash != header.hash():
+                        raise Exception(
+                            f"Block {block.block_hash} does not match header at height {len(blockchain.chain)}")
+                    blockchain.verify_block(block)
+                    blockchain.add_block(block)
+                    added += 1
+    finally:
+        for session in sessions:
+            session.close()
+    return added
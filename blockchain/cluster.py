@@ -0,0 +1,195 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, TextIO
+import fire
+import requests
+from client_utils import get_chain_info, get_transaction_status, get_block, mine_block
+from loadgen import LoadGenerator, presign, percentile
+from wallet_pool import load_wallets
+
+HOST = 'http://localhost'
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+TOPOLOGIES = ('ring', 'mesh', 'star')
+POLL_INTERVAL = 0.01
+
+
+def topology(name: str, n: int) -> List[List[int]]:
+    """
+    Peer indexes of every node. Links go both ways and peers are listed in ascending order, so
+    every node but node 0 bootstraps from a node that was started before it.
+    """
+    if name == 'ring':
+        return [sorted({(i - 1) % n, (i + 1) % n} - {i}) for i in range(n)]
+    if name == 'mesh':
+        return [[j for j in range(n) if j != i] for i in range(n)]
+    if name == 'star':
+        return [list(range(1, n))] + [[0] for _ in range(1, n)]
+    raise ValueError(f"Unknown topology {name}, expecting one of {', '.join(TOPOLOGIES)}")
+
+
+def wait_for(condition: Callable[[], bool], timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if condition():
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(POLL_INTERVAL)
+    return False
+
+
+def summarize(values: List[float]) -> Dict:
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'max': values[-1] if values else 0.0
+    }
+
+
+class Cluster:
+    """
+    N local nodes wired in a topology, each a server.py process with its own port and log.
+    Node 0 generates the chain, the others sync it from their peers.
+    """
+
+    def __init__(self, n: int, topology_name: str = 'ring', base_port: int = 5100, difficulty: int = 2,
+                 workdir: str = None):
+        self.n = n
+        self.ports = [base_port + i for i in range(n)]
+        self.peers = topology(topology_name, n)
+        self.difficulty = difficulty
+        self.workdir = workdir or tempfile.mkdtemp(prefix='cluster_')
+        self.processes: List[subprocess.Popen] = []
+        self.logs: List[TextIO] = []
+        self.session = requests.Session()
+        self._wallets = None
+
+    def start(self, timeout: float = 60):
+        for i in range(self.n):
+            args = [sys.executable, SERVER, f'--port={self.ports[i]}', f'--difficulty={self.difficulty}',
+                    '--debug=False', f'--sync={i > 0}']
+            if self.peers[i]:
+                args.append('--peers=[' + ','.join(str(self.ports[j]) for j in self.peers[i]) + ']')
+            log = open(os.path.join(self.workdir, f'node_{i}.log'), 'w')
+            self.logs.append(log)
+            self.processes.append(subprocess.Popen(args, cwd=self.workdir, stdout=log, stderr=subprocess.STDOUT))
+            if not wait_for(lambda: self.info(i) is not None, timeout):
+                raise RuntimeError(f"Node {i} did not start, see {log.name}")
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in self.logs:
+            log.close()
+        self.logs = []
+
+    def info(self, i: int) -> Dict:
+        return get_chain_info(HOST, self.ports[i], self.session)
+
+    def wallets(self):
+        # node 0 saved the wallets it funded in its genesis block
+        if self._wallets is None:
+            self._wallets = load_wallets(os.path.join(self.workdir, 'tmp', 'wallets'))
+        return self._wallets
+
+    def mempool_convergence(self, timeout: float) -> float:
+        """
+        Seconds until every node holds the same mempool, None on timeout.
+        """
+        start = time.time()
+        converged = wait_for(lambda: len({self.info(i)['mempool_digest'] for i in range(self.n)}) == 1, timeout)
+        return time.time() - start if converged else None
+
+    def transaction_propagation(self, txids: List[str], entry: int) -> Dict:
+        delays: Dict[int, List[float]] = {i: [] for i in range(self.n) if i != entry}
+        for txid in txids:
+            sent = get_transaction_status(HOST, self.ports[entry], txid, self.session)['received_at']
+            for i in delays:
+                received = get_transaction_status(HOST, self.ports[i], txid, self.session)['received_at']
+                if sent is not None and received is not None:
+                    delays[i].append((received - sent) * 1e3)
+        return {
+            'all': summarize([d for node_delays in delays.values() for d in node_delays]),
+            'per_node': {str(i): summarize(node_delays) for i, node_delays in delays.items()}
+        }
+
+    def block_propagation(self, n_blocks: int, timeout: float) -> Dict:
+        delays: Dict[int, List[float]] = {i: [] for i in range(self.n)}
+        missing = 0
+        for k in range(n_blocks):
+            miner = k % self.n
+            job = mine_block(HOST, self.ports[miner], self.miner, wait=True, session=self.session)
+            block_hash = job['block_hash']
+            mined = get_block(HOST, self.ports[miner], block_hash, self.session)['received_at']
+            for i in range(self.n):
+                if i == miner:
+                    continue
+                if not wait_for(lambda: get_block(HOST, self.ports[i], block_hash, self.session) is not None, timeout):
+                    missing += 1
+                    continue
+                received = get_block(HOST, self.ports[i], block_hash, self.session)['received_at']
+                delays[i].append((received - mined) * 1e3)
+        return {
+            'all': summarize([d for node_delays in delays.values() for d in node_delays]),
+            'per_node': {str(i): summarize(node_delays) for i, node_delays in delays.items() if node_delays},
+            'missing': missing
+        }
+
+    @property
+    def miner(self) -> str:
+        return str(self.wallets()[0].public_key)
+
+
+def main(nodes: int = 4, topology_name: str = 'ring', base_port: int = 5100, difficulty: int = 2,
+         tps: float = 50, duration: float = 5, connections: int = 4, entry: int = 0, blocks: int = 3,
+         sample: int = 50, timeout: float = 30, output: str = 'cluster_results.json', workdir: str = None):
+    """
+    Start a local cluster, send load into the entry node, then measure transaction propagation,
+    mempool convergence and block propagation, and write everything to output as JSON.
+    """
+    cluster = Cluster(nodes, topology_name, base_port, difficulty, workdir)
+    print('starting', nodes, 'nodes in a', topology_name, 'in', cluster.workdir)
+    try:
+        cluster.start()
+        transactions = presign(cluster.wallets(), int(tps * duration))
+        report = LoadGenerator(HOST, cluster.ports[entry], transactions, tps, connections).run()
+        convergence = cluster.mempool_convergence(timeout)
+        step = max(1, len(transactions) // sample)
+        results = {
+            'config': {
+                'nodes': nodes,
+                'topology': topology_name,
+                'peers': cluster.peers,
+                'difficulty': difficulty,
+                'tps': tps,
+                'duration': duration,
+                'entry': entry
+            },
+            'load': report,
+            'mempool_convergence_s': convergence,
+            'transaction_propagation_ms': cluster.transaction_propagation(
+                [txn.txid for txn in transactions[::step]], entry),
+            'block_propagation_ms': cluster.block_propagation(blocks, timeout)
+        }
+    finally:
+        cluster.stop()
+    print(json.dumps(results, indent=2))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('results written to', output)
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
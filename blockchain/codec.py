@@ -0,0 +1,202 @@
+import base64
+import hashlib
+import struct
+from typing import Dict, List, Optional, Tuple
+from cryptography.hazmat.primitives import serialization
+from cache import LRUCache
+from custom_types import Transaction, PublicKey, GenesisPublicKey, TX_VERSION_LEGACY, SIGNING_PAYLOAD, FINGERPRINT_SIZE
+from signatures import load_public_bytes
+
+# version, ts, amount, sender key length, receiver key length, signature length,
+# followed by the binary encoded keys (see PublicKey.to_bytes) and the signature
+WIRE_HEADER = struct.Struct('>BdQHHH')
+STR_HEADER = struct.Struct('>H')
+COUNT = struct.Struct('>I')
+# block streams frame every encoded block with its length
+BLOCK_FRAME = struct.Struct('>I')
+# compact blocks name their transactions by the first bytes of the txid
+SHORT_ID_SIZE = 8
+# position of a transaction sent along with a compact block
+INDEX = struct.Struct('>I')
+
+# PEM -> PublicKey, peers and wallets resend the same keys over and over
+public_key_cache = LRUCache(10_000)
+
+
+def deserialize_public_key(data: str) -> PublicKey:
+    public_key = public_key_cache.get(data)
+    if public_key is None:
+        public_key = PublicKey(serialization.load_pem_public_key(data.encode('utf-8')))
+        public_key_cache.put(data, public_key)
+    return public_key
+
+
+def deserialize_public_key_bytes(data: bytes) -> PublicKey:
+    public_key = public_key_cache.get(data)
+    if public_key is None:
+        public_key = PublicKey(load_public_bytes(data))
+        public_key_cache.put(data, public_key)
+    return public_key
+
+
+def address_from_str(data: str) -> PublicKey:
+    # the genesis address serializes to an empty string
+    return GenesisPublicKey(None) if data == "" else deserialize_public_key(data)
+
+
+def address_from_bytes(data: bytes) -> PublicKey:
+    return GenesisPublicKey(None) if data == b"" else deserialize_public_key_bytes(data)
+
+
+def transaction_to_dict(txn: Transaction) -> Dict:
+    return {
+        'sender': str(txn.from_addr),
+        'receiver': str(txn.to_addr),
+        'amount': txn.amount,
+        'signature': base64.b64encode(txn.signature).decode('utf-8'),
+        'ts': txn.ts,
+        'version': txn.version
+    }
+
+
+def transaction_from_dict(data: Dict) -> Transaction:
+    return Transaction(
+        from_addr=address_from_str(data['sender']),
+        to_addr=address_from_str(data['receiver']),
+        amount=int(data['amount']),
+        signature=base64.b64decode(data['signature']),
+        ts=data['ts'],
+        version=data.get('version', TX_VERSION_LEGACY)
+    )
+
+
+def transaction_to_bytes(txn: Transaction) -> bytes:
+    from_key = txn.from_addr.to_bytes()
+    to_key = txn.to_addr.to_bytes()
+    return WIRE_HEADER.pack(
+        txn.version,
+        float(txn.ts),
+        txn.amount,
+        len(from_key),
+        len(to_key),
+        len(txn.signature)
+    ) + from_key + to_key + txn.signature
+
+
+def transaction_from_bytes(data: bytes, offset: int = 0) -> Tuple[Transaction, int]:
+    """
+    Decode one transaction starting at offset, returns it with the offset right after it.
+    """
+    version, ts, amount, from_len, to_len, sig_len = WIRE_HEADER.unpack_from(data, offset)
+    pos = offset + WIRE_HEADER.size
+    end = pos + from_len + to_len + sig_len
+    if end > len(data):
+        raise ValueError("Truncated transaction")
+    from_key = bytes(data[pos:pos + from_len])
+    to_key = bytes(data[pos + from_len:pos + from_len + to_len])
+    signature = bytes(data[pos + from_len + to_len:end])
+    txn = Transaction(
+        from_addr=address_from_bytes(from_key),
+        to_addr=address_from_bytes(to_key),
+        amount=amount,
+        signature=signature,
+        ts=ts,
+        version=version
+    )
+    return txn, end
+
+
+def transaction_ids_from_bytes(data: bytes, offset: int = 0) -> List[Tuple[int, Optional[str]]]:
+    """
+    (offset, txid) of every transaction in an encoded batch, computed from the raw key bytes so
+    duplicates can be dropped before any key is loaded. Legacy transactions hash the PEM text of
+    their keys, their txid is None.
+    """
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    ids = []
+    for _ in range(count):
+        version, ts, amount, from_len, to_len, sig_len = WIRE_HEADER.unpack_from(data, offset)
+        pos = offset + WIRE_HEADER.size
+        end = pos + from_len + to_len + sig_len
+        if end > len(data):
+            raise ValueError("Truncated transaction")
+        txid = None
+        if version != TX_VERSION_LEGACY:
+            payload = SIGNING_PAYLOAD.pack(
+                version,
+                _fingerprint(data[pos:pos + from_len]),
+                _fingerprint(data[pos + from_len:pos + from_len + to_len]),
+                amount,
+                ts
+            )
+            txid = hashlib.sha256(payload + data[pos + from_len + to_len:end]).hexdigest()
+        ids.append((offset, txid))
+        offset = end
+    return ids
+
+
+def _fingerprint(key: bytes) -> bytes:
+    # same as PublicKey.fingerprint_bytes, the genesis address encodes to no bytes
+    return hashlib.sha256(key).digest()[:FINGERPRINT_SIZE] if key else bytes(FINGERPRINT_SIZE)
+
+
+def transaction_wire_size(txn: Transaction) -> int:
+    return WIRE_HEADER.size + len(txn.from_addr.to_bytes()) + len(txn.to_addr.to_bytes()) + len(txn.signature)
+
+
+def transactions_to_bytes(transactions: List[Transaction]) -> bytes:
+    return COUNT.pack(len(transactions)) + b"".join(transaction_to_bytes(txn) for txn in transactions)
+
+
+def transactions_from_bytes(data: bytes, offset: int = 0) -> Tuple[List[Transaction], int]:
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    transactions = []
+    for _ in range(count):
+        txn, offset = transaction_from_bytes(data, offset)
+        transactions.append(txn)
+    return transactions, offset
+
+
+def short_id(txid: str) -> bytes:
+    return bytes.fromhex(txid[:2 * SHORT_ID_SIZE])
+
+
+def short_ids_to_bytes(ids: List[bytes]) -> bytes:
+    return COUNT.pack(len(ids)) + b"".join(ids)
+
+
+def short_ids_from_bytes(data: bytes, offset: int = 0) -> Tuple[List[bytes], int]:
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    end = offset + count * SHORT_ID_SIZE
+    if end > len(data):
+        raise ValueError("Truncated short ids")
+    return [bytes(data[pos:pos + SHORT_ID_SIZE]) for pos in range(offset, end, SHORT_ID_SIZE)], end
+
+
+def indexed_transactions_to_bytes(transactions: List[Tuple[int, Transaction]]) -> bytes:
+    return COUNT.pack(len(transactions)) + b"".join(
+        INDEX.pack(index) + transaction_to_bytes(txn) for index, txn in transactions)
+
+
+def indexed_transactions_from_bytes(data: bytes, offset: int = 0) -> Tuple[Dict[int, Transaction], int]:
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    transactions = {}
+    for _ in range(count):
+        (index,) = INDEX.unpack_from(data, offset)
+        transactions[index], offset = transaction_from_bytes(data, offset + INDEX.size)
+    return transactions, offset
+
+
+def pack_str(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return STR_HEADER.pack(len(data)) + data
+
+
+def unpack_str(data: bytes, offset: int = 0) -> Tuple[str, int]:
+    (length,) = STR_HEADER.unpack_from(data, offset)
+    start = offset + STR_HEADER.size
+    return bytes(data[start:start + length]).decode('utf-8'), start + length
@@ -1,9 +1,21 @@
 from __future__ import annotations  # postpone type evaluation until explicitly invoked
+import hashlib
+import struct
 import time
-from dataclasses import dataclass
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey, RSAPrivateKey
-from cryptography.hazmat.primitives import hashes, serialization
+from dataclasses import dataclass, field
+from cryptography.hazmat.primitives import serialization
+from signatures import SignatureScheme, DEFAULT_SCHEME, get_scheme, scheme_for_key
+
+
+FINGERPRINT_SIZE = 20
+
+# version 1 signs and hashes the PEM text of both keys, kept so existing chains still verify
+TX_VERSION_LEGACY = 1
+# version 2 signs and hashes a fixed-width payload built from key fingerprints
+TX_VERSION_COMPACT = 2
+
+# version, sender fingerprint, receiver fingerprint, amount, ts
+SIGNING_PAYLOAD = struct.Struct(f'>B{FINGERPRINT_SIZE}s{FINGERPRINT_SIZE}sQd')
 
 
 @dataclass
@@ -12,75 +24,132 @@ class Transaction:
     to_addr: PublicKey
     amount: int
     signature: bytes = b''
-    ts: int = int(time.time())
+    # signed and part of the txid, so every transaction gets its own creation time
+    ts: float = field(default_factory=time.time)
+    version: int = TX_VERSION_COMPACT
 
     def __str__(self):
         return str(self.from_addr) + str(self.to_addr) + str(self.amount) + self.signature.hex()
 
-    def encode(self):
-        return (str(self.from_addr) + str(self.to_addr) + str(self.amount)).encode('utf-8')
+    def encode(self) -> bytes:
+        # the bytes covered by the signature
+        if self.version == TX_VERSION_LEGACY:
+            return (str(self.from_addr) + str(self.to_addr) + str(self.amount)).encode('utf-8')
+        return SIGNING_PAYLOAD.pack(
+            self.version,
+            self.from_addr.fingerprint_bytes,
+            self.to_addr.fingerprint_bytes,
+            self.amount,
+            float(self.ts)
+        )
+
+    def hash_bytes(self) -> bytes:
+        # the bytes a block hash commits to
+        if self.version == TX_VERSION_LEGACY:
+            return str(self).encode('utf-8')
+        return self.encode() + self.signature
+
+    @property
+    def txid(self) -> str:
+        return hashlib.sha256(self.encode() + self.signature).hexdigest()
 
     def __eq__(self, other: Transaction):
-        return self.amount == other.amount and str(self.from_addr) == str(other.from_addr) \
-            and str(self.to_addr) == str(other.to_addr) and self.signature == other.signature
+        return self.amount == other.amount and self.from_addr == other.from_addr \
+            and self.to_addr == other.to_addr and self.signature == other.signature
 
 
 class PrivateKey:
-    def __init__(self, key: RSAPrivateKey):
+    def __init__(self, key):
         self._private_key = key
+        self.scheme: SignatureScheme = scheme_for_key(key)
 
     def __str__(self):
-        key_bytes = self._private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.TraditionalOpenSSL,
-            encryption_algorithm=serialization.NoEncryption()
-        )
-        return key_bytes.decode('utf-8')
+        return self.scheme.private_pem(self._private_key)
+
+    def to_bytes(self) -> bytes:
+        return self.scheme.private_bytes(self._private_key)
 
     def sign(self, transaction: Transaction) -> Transaction:
-        sig: bytes = self._private_key.sign(
-            transaction.encode(),
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
-        transaction.signature = sig
+        transaction.signature = self.scheme.sign(self._private_key, transaction.encode())
         return transaction
 
 
 class PublicKey:
-    def __init__(self, key: RSAPublicKey):
+    # the key is immutable, so its encodings are serialized once and cached
+    def __init__(self, key):
         self._public_key = key
+        self.scheme: SignatureScheme = scheme_for_key(key) if key is not None else None
+        self._pem = None
+        self._bytes = None
+        self._fingerprint = None
+        self._address = None
 
     def __str__(self):
-        key_bytes = self._public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        return key_bytes.decode('utf-8')
+        if self._pem is None:
+            self._pem = self._public_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo
+            ).decode('utf-8')
+        return self._pem
+
+    def to_bytes(self) -> bytes:
+        # canonical binary encoding of the key, DER for RSA and the raw 32 bytes for Ed25519
+        if self._bytes is None:
+            self._bytes = self.scheme.public_bytes(self._public_key)
+        return self._bytes
+
+    @property
+    def fingerprint_bytes(self) -> bytes:
+        # short address of the key, the first 20 bytes of sha256(to_bytes())
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.sha256(self.to_bytes()).digest()[:FINGERPRINT_SIZE]
+        return self._fingerprint
+
+    @property
+    def fingerprint(self) -> str:
+        if self._address is None:
+            self._address = self.fingerprint_bytes.hex()
+        return self._address
 
     @property
     def public_key(self):
         return self._public_key
 
+    def verify(self, data: bytes, signature: bytes) -> bool:
+        return self.scheme.verify(self._public_key, data, signature)
+
     def __eq__(self, other: PublicKey):
-        return str(self) == str(other)
+        if not isinstance(other, PublicKey):
+            return NotImplemented
+        return self.fingerprint_bytes == other.fingerprint_bytes
+
+    def __hash__(self):
+        return hash(self.fingerprint_bytes)
 
 
 class GenesisPublicKey(PublicKey):
-    def __init__(self, key: RSAPublicKey):
+    def __init__(self, key):
         super().__init__(key)
 
     def __str__(self):
         return ""
 
+    def to_bytes(self) -> bytes:
+        return b""
+
+    def verify(self, data: bytes, signature: bytes) -> bool:
+        # nothing can be signed by the genesis address
+        return False
+
+    @property
+    def fingerprint_bytes(self) -> bytes:
+        return bytes(FINGERPRINT_SIZE)
+
 
 class Wallet:
-    def __init__(self, public_key=None, private_key=None):
+    def __init__(self, public_key=None, private_key=None, scheme: str = DEFAULT_SCHEME):
         if public_key is None or private_key is None:
-            self.private_key, self.public_key = _generate_key_pair()
+            self.private_key, self.public_key = _generate_key_pair(scheme)
         else:
             self.public_key = public_key
             self.private_key = private_key
@@ -89,10 +158,6 @@ class Wallet:
         return self.private_key.sign(transaction)
 
 
-def _generate_key_pair():
-    private_key = rsa.generate_private_key(
-        public_exponent=65537,
-        key_size=2048
-    )
-    public_key = private_key.public_key()
+def _generate_key_pair(scheme: str = DEFAULT_SCHEME):
+    private_key, public_key = get_scheme(scheme).generate()
     return PrivateKey(private_key), PublicKey(public_key)
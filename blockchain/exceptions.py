@@ -1,6 +1,18 @@
 class InvalidSignatureException(Exception):
-    pass
+    def __init__(self, message: str = "", invalid_transactions: list = None):
+        super().__init__(message)
+        self.invalid_transactions = invalid_transactions if invalid_transactions else []
 
 
 class InsufficientFundsException(Exception):
     pass
+
+
+class MiningCancelledException(Exception):
+    pass
+
+
+class MiningInProgressException(Exception):
+    def __init__(self, message: str = "", job=None):
+        super().__init__(message)
+        self.job = job
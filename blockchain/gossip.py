@@ -0,0 +1,179 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Union
+import requests
+from requests.adapters import HTTPAdapter
+from custom_types import Transaction
+from client_utils import add_transactions, add_compact_block
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BATCH_WINDOW = 0.05
+MAX_BATCH = 100
+MAX_QUEUE = 10_000
+MAX_RETRIES = 3
+BACKOFF = 0.2
+POOL_SIZE = 4
+# peer links a transaction or block may still cross, every relay decrements it
+HOP_LIMIT = 8
+
+PEER_SEND_SECONDS = registry.histogram('peer_send_seconds', 'Time to send one transaction batch to a peer')
+PEER_SEND_FAILURES = registry.counter('peer_send_failures_total', 'Transaction batches that could not be sent to a peer')
+
+
+@dataclass
+class BlockRelay:
+    # compact encoding of a block, its transactions are only sent for the indexes a peer asks for
+    compact: bytes
+    transactions: List[Transaction]
+
+
+Item = Union[Transaction, BlockRelay]
+
+
+class PeerSender:
+    """
+    Sends queued transactions and blocks to one peer from a background thread over a persistent session.
+    Transactions arriving within batch_window of each other are sent together, a block ends the batch
+    so it is never held back, and failed sends are retried with exponential backoff.
+    Queue entries are (item, hop limit) pairs, the hop limit is forwarded with the item.
+    """
+
+    def __init__(self, peer: Tuple, batch_window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH,
+                 max_queue: int = MAX_QUEUE, max_retries: int = MAX_RETRIES, backoff: float = BACKOFF):
+        self.host, self.port = peer[0], peer[1]
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._send_seconds = PEER_SEND_SECONDS.labels(peer=f"{self.host}:{self.port}")
+        self._send_failures = PEER_SEND_FAILURES.labels(peer=f"{self.host}:{self.port}")
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Item, hop_limit: int = HOP_LIMIT):
+        try:
+            self.queue.put_nowait((item, hop_limit))
+        except queue.Full:
+            logger.warning(f"Broadcast queue to {self.host}:{self.port} is full, dropping {type(item).__name__}")
+
+    def _next_batch(self) -> List[Tuple[Item, int]]:
+        batch = [self.queue.get()]
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.max_batch and not isinstance(batch[-1][0], BlockRelay):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while 1:
+            batch = self._next_batch()
+            try:
+                self.send(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def send(self, batch: List[Tuple[Item, int]]):
+        transactions = []
+        transactions_hop_limit = None
+        for item, hop_limit in batch:
+            # keep the order, a block may confirm transactions queued before it,
+            # and a request carries one hop limit so a change of hop limit starts a new request
+            if transactions and (isinstance(item, BlockRelay) or hop_limit != transactions_hop_limit):
+                self._with_retry(self._send_batch, transactions, transactions_hop_limit)
+                transactions = []
+            if isinstance(item, BlockRelay):
+                self._with_retry(self._send_block, item, hop_limit)
+            else:
+                transactions.append(item)
+                transactions_hop_limit = hop_limit
+        if transactions:
+            self._with_retry(self._send_batch, transactions, transactions_hop_limit)
+
+    def _send_block(self, relay: BlockRelay, hop_limit: int):
+        start = time.perf_counter()
+        sent: List[Tuple[int, Transaction]] = []
+        while 1:
+            result = add_compact_block(host=self.host, port=self.port, payload=relay.compact, transactions=sent,
+                                       session=self.session, hop_limit=hop_limit)
+            if result['status'] != 'missing' or len(sent) == len(relay.transactions):
+                break
+            # the transactions the peer asked for, every transaction if that was not enough
+            indexes = result['missing'] if not sent else range(len(relay.transactions))
+            sent = [(i, relay.transactions[i]) for i in indexes]
+        self._send_seconds.observe(time.perf_counter() - start)
+
+    def _send_batch(self, batch: List[Transaction], hop_limit: int):
+        start = time.perf_counter()
+        add_transactions(
+            host=self.host,
+            port=self.port,
+            transactions=batch,
+            session=self.session,
+            binary=True,
+            hop_limit=hop_limit)
+        self._send_seconds.observe(time.perf_counter() - start)
+
+    def _with_retry(self, func, *args) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                func(*args)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self._send_failures.inc()
+                    logger.warning(f"Failed to broadcast to {self.host}:{self.port} after {attempt + 1} attempts: {e}")
+                    return False
+                time.sleep(self.backoff * 2 ** attempt)
+        return False
+
+
+class Broadcaster:
+    """
+    Outbound gossip queue, keeps one PeerSender per peer so a slow peer never delays the others
+    or the request that produced the transaction.
+    """
+
+    def __init__(self, peers: List[Tuple], **sender_options):
+        self.peers = peers
+        self.sender_options = sender_options
+        self._senders: Dict[Tuple, PeerSender] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, transaction: Transaction, hop_limit: int = HOP_LIMIT):
+        for sender in self.senders():
+            sender.submit(transaction, hop_limit)
+
+    def submit_block(self, relay: BlockRelay, hop_limit: int = HOP_LIMIT):
+        for sender in self.senders():
+            sender.submit(relay, hop_limit)
+
+    def senders(self) -> List[PeerSender]:
+        with self._lock:
+            for peer in self.peers:
+                peer = tuple(peer)
+                if peer not in self._senders:
+                    self._senders[peer] = PeerSender(peer, **self.sender_options)
+            return list(self._senders.values())
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            senders = list(self._senders.values())
+        return sum(sender.queue.qsize() for sender in senders)
+
+    def flush(self):
+        for sender in self.senders():
+            sender.queue.join()
@@ -0,0 +1,59 @@
+from __future__ import annotations
+import hashlib
+import struct
+from dataclasses import dataclass, asdict
+from typing import Dict
+
+HEADER_VERSION = 2
+
+# version, prev hash, merkle root, difficulty, timestamp
+HEADER_PREFIX = struct.Struct('>B32s32sId')
+NONCE = struct.Struct('>Q')
+HEADER_SIZE = HEADER_PREFIX.size + NONCE.size
+
+
+def hash_to_bytes(block_hash: str) -> bytes:
+    # the genesis block has no real hash ("0x0"), it is committed to as all zeros
+    if len(block_hash) == 64:
+        return bytes.fromhex(block_hash)
+    return bytes(32)
+
+
+@dataclass
+class BlockHeader:
+    prev_hash: str
+    merkle_root: str
+    difficulty: int
+    timestamp: float
+    nonce: int = 0
+    version: int = HEADER_VERSION
+
+    def prefix(self) -> bytes:
+        # every header field except the nonce
+        return HEADER_PREFIX.pack(
+            self.version,
+            hash_to_bytes(self.prev_hash),
+            bytes.fromhex(self.merkle_root),
+            self.difficulty,
+            self.timestamp
+        )
+
+    def serialize(self) -> bytes:
+        return self.prefix() + NONCE.pack(self.nonce)
+
+    def hash(self) -> str:
+        return hashlib.sha256(self.serialize()).hexdigest()
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> BlockHeader:
+        return cls(
+            prev_hash=data['prev_hash'],
+            merkle_root=data['merkle_root'],
+            difficulty=int(data['difficulty']),
+            timestamp=float(data['timestamp']),
+            nonce=int(data['nonce']),
+            version=int(data.get('version', HEADER_VERSION))
+        )
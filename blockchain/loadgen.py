@@ -0,0 +1,187 @@
+import json
+import math
+import os
+import queue
+import threading
+import time
+from typing import Dict, List
+import fire
+import requests
+from requests.adapters import HTTPAdapter
+from client_utils import add_transaction, add_transactions, mine_block
+from custom_types import Transaction, Wallet
+from signatures import DEFAULT_SCHEME
+from utils import generate_signed_transaction
+from wallet_pool import take_wallets, load_wallets
+
+# wallets saved by server.main, funded in its genesis block
+NODE_WALLETS = 'tmp/wallets'
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest rank
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def presign(wallets: List[Wallet], count: int, amount: int = 1) -> List[Transaction]:
+    # signed before the run so signing cost never shows up in the measured send rate
+    # senders take turns and pass the amount on to the next wallet, so in timestamp order no
+    # balance ever drops by more than amount and mined blocks keep passing the balance check
+    start_ts = time.time()
+    transactions = []
+    for i in range(count):
+        sender, receiver = wallets[i % len(wallets)], wallets[(i + 1) % len(wallets)]
+        # distinct timestamps keep every txid unique even for repeated sender/receiver pairs
+        transactions.append(generate_signed_transaction(sender, receiver, amount, ts=start_ts + i * 1e-6))
+    return transactions
+
+
+class LoadGenerator:
+    """
+    Sends pre-signed transactions at a fixed target rate from several connections.
+    Every request has a scheduled send time, latency is measured from that time rather than from
+    the actual send so a node that falls behind shows up in the percentiles instead of lowering the rate.
+    """
+
+    def __init__(self, host: str, port: int, transactions: List[Transaction], tps: float,
+                 connections: int = 8, batch: int = 1):
+        self.host = host
+        self.port = port
+        self.tps = tps
+        self.connections = connections
+        self.batch = batch
+        self.batches = [transactions[i:i + batch] for i in range(0, len(transactions), batch)]
+        self.latencies: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def run(self) -> Dict:
+        work: queue.Queue = queue.Queue()
+        start = time.perf_counter() + 0.1
+        for i, batch in enumerate(self.batches):
+            work.put((start + i * self.batch / self.tps, batch))
+        threads = [threading.Thread(target=self._worker, args=(work,), daemon=True) for _ in range(self.connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - start)
+
+    def _worker(self, work: queue.Queue):
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        while 1:
+            try:
+                scheduled, batch = work.get_nowait()
+            except queue.Empty:
+                return
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                statuses = self._send(session, batch)
+            except Exception as e:
+                statuses = [type(e).__name__]
+            latency = time.perf_counter() - scheduled
+            with self._lock:
+                self.latencies.append(latency)
+                # only accepted transactions count as sent, duplicates and rejections are errors
+                for status in statuses:
+                    if status == 'accepted':
+                        self.sent += 1
+                    else:
+                        self.errors[status] = self.errors.get(status, 0) + 1
+
+    def _send(self, session: requests.Session, batch: List[Transaction]) -> List[str]:
+        if len(batch) == 1:
+            return [add_transaction(self.host, self.port, batch[0], session=session, verbose=False)['status']]
+        return [result['status'] for result in add_transactions(self.host, self.port, batch, session=session,
+                                                                binary=True)]
+
+    def report(self, elapsed: float) -> Dict:
+        latencies = sorted(self.latencies)
+        return {
+            'target_tps': self.tps,
+            'achieved_tps': self.sent / elapsed if elapsed > 0 else 0.0,
+            'transactions': self.sent,
+            'requests': len(latencies),
+            'errors': self.errors,
+            'duration': elapsed,
+            'latency_ms': {
+                'p50': percentile(latencies, 50) * 1e3,
+                'p95': percentile(latencies, 95) * 1e3,
+                'p99': percentile(latencies, 99) * 1e3,
+                'max': (latencies[-1] if latencies else 0.0) * 1e3
+            }
+        }
+
+
+class MiningTrigger:
+    # starts a mining job every interval seconds until stopped
+    def __init__(self, host: str, port: int, miner: str, interval: float):
+        self.host = host
+        self.port = port
+        self.miner = miner
+        self.interval = interval
+        self.jobs: List[Dict] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        session = requests.Session()
+        while not self._stop.wait(self.interval):
+            try:
+                self.jobs.append(mine_block(self.host, self.port, self.miner, wait=True, session=session))
+            except Exception as e:
+                self.jobs.append({'status': 'failed', 'error': str(e)})
+
+    def summary(self) -> Dict[str, int]:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs:
+            statuses[job['status']] = statuses.get(job['status'], 0) + 1
+        return statuses
+
+
+def main(host: str = 'http://localhost', port: int = 5000, tps: float = 100, duration: float = 10,
+         connections: int = 8, batch: int = 1, n_wallets: int = 100, scheme: str = DEFAULT_SCHEME,
+         wallets_file: str = None, mine_interval: float = None, output: str = None):
+    """
+    Apply a steady transaction load to a node and print latency percentiles and achieved throughput.
+    Senders come from the wallet pool, or from wallets_file (default tmp/wallets when it exists, the
+    wallets the node funded at startup) so mined blocks do not fail the balance check.
+    """
+    if wallets_file is None and os.path.exists(NODE_WALLETS):
+        wallets_file = NODE_WALLETS
+    wallets = load_wallets(wallets_file) if wallets_file else take_wallets(n_wallets, scheme)
+    count = int(tps * duration)
+    print(f'signing {count} transactions from {len(wallets)} wallets')
+    transactions = presign(wallets, count)
+
+    trigger = None
+    if mine_interval:
+        trigger = MiningTrigger(host, port, str(wallets[0].public_key), mine_interval)
+        trigger.start()
+    report = LoadGenerator(host, port, transactions, tps, connections, batch).run()
+    if trigger is not None:
+        trigger.stop()
+        report['mining'] = trigger.summary()
+
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,137 @@
+import bisect
+import threading
+from typing import Dict, List, Tuple, Iterable
+from custom_types import Transaction
+from codec import transaction_wire_size, short_id
+
+DEFAULT_MAX_COUNT = 50_000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class Mempool:
+    """
+    Pending transactions indexed by txid.
+    Keeps transactions ordered by timestamp, indexes them per sender and evicts the oldest
+    ones once the count or byte limit is exceeded.
+    """
+
+    def __init__(self, max_count: int = DEFAULT_MAX_COUNT, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._txns: Dict[str, Transaction] = {}
+        self._sizes: Dict[str, int] = {}
+        # dicts keep insertion order and give O(1) removal
+        self._by_sender: Dict[str, Dict[str, None]] = {}
+        # (ts, seq, txid) sorted, entries of removed transactions are skipped and compacted lazily
+        self._order: List[Tuple[float, int, str]] = []
+        self._head = 0
+        self._stale = 0
+        self._seq = 0
+        # short id -> txid, compact blocks are rebuilt from it; on a collision the later transaction wins
+        # and the merkle root check of the rebuilt block catches the wrong pick
+        self._short_ids: Dict[bytes, str] = {}
+        # xor of all pending txids, equal on two nodes exactly when they hold the same set (barring collisions)
+        self._digest = 0
+        self._lock = threading.RLock()
+
+    def add(self, txn: Transaction) -> bool:
+        """
+        Returns False when the transaction is already pending.
+        """
+        txid = txn.txid
+        with self._lock:
+            if txid in self._txns:
+                return False
+            size = transaction_size(txn)
+            self._txns[txid] = txn
+            self._sizes[txid] = size
+            self._by_sender.setdefault(txn.from_addr.fingerprint, {})[txid] = None
+            self.total_bytes += size
+            self._digest ^= int(txid, 16)
+            self._short_ids[short_id(txid)] = txid
+            self._seq += 1
+            entry = (txn.ts, self._seq, txid)
+            if not self._order or entry > self._order[-1]:
+                self._order.append(entry)
+            else:
+                bisect.insort(self._order, entry, lo=self._head)
+            self._evict()
+            return True
+
+    def remove(self, txid: str) -> bool:
+        with self._lock:
+            if not self._discard(txid):
+                return False
+            # its order entry stays behind until the next compaction
+            self._stale += 1
+            self._compact()
+            return True
+
+    def _discard(self, txid: str) -> bool:
+        # drop the transaction from every index except the timestamp order
+        with self._lock:
+            txn = self._txns.pop(txid, None)
+            if txn is None:
+                return False
+            self.total_bytes -= self._sizes.pop(txid)
+            self._digest ^= int(txid, 16)
+            sid = short_id(txid)
+            if self._short_ids.get(sid) == txid:
+                del self._short_ids[sid]
+            sender = txn.from_addr.fingerprint
+            sender_txns = self._by_sender[sender]
+            del sender_txns[txid]
+            if not sender_txns:
+                del self._by_sender[sender]
+            return True
+
+    def remove_transactions(self, transactions: Iterable[Transaction]):
+        with self._lock:
+            for txn in transactions:
+                self.remove(txn.txid)
+
+    def get(self, txid: str) -> Transaction:
+        return self._txns.get(txid)
+
+    def get_by_short_id(self, sid: bytes) -> Transaction:
+        txid = self._short_ids.get(sid)
+        return self._txns.get(txid) if txid is not None else None
+
+    def transactions(self) -> List[Transaction]:
+        with self._lock:
+            return [self._txns[txid] for _, _, txid in self._order[self._head:] if txid in self._txns]
+
+    def digest(self) -> str:
+        return f'{self._digest:064x}'
+
+    def by_sender(self, address: str) -> List[Transaction]:
+        with self._lock:
+            return [self._txns[txid] for txid in self._by_sender.get(address, ())]
+
+    def _evict(self):
+        # drop the oldest transactions until both limits hold
+        while len(self._txns) > self.max_count or self.total_bytes > self.max_bytes:
+            _, _, txid = self._order[self._head]
+            self._head += 1
+            # the entry is now behind the head: a pending transaction is dropped without ever
+            # counting as stale, an already removed one no longer counts as stale
+            if not self._discard(txid):
+                self._stale -= 1
+        self._compact()
+
+    def _compact(self):
+        if self._head + self._stale > len(self._order) // 2 + 64:
+            self._order = [entry for entry in self._order[self._head:] if entry[2] in self._txns]
+            self._head = 0
+            self._stale = 0
+
+    def __contains__(self, txid: str) -> bool:
+        return txid in self._txns
+
+    def __len__(self) -> int:
+        return len(self._txns)
+
+
+def transaction_size(txn: Transaction) -> int:
+    return transaction_wire_size(txn)
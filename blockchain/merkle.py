@@ -0,0 +1,44 @@
+import hashlib
+from typing import List, Dict
+
+
+def _hash_pair(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(left + right).digest()
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    """
+    Root of a binary Merkle tree over the leaves, an odd node at any level is paired with itself.
+    """
+    if not leaves:
+        return bytes(32)
+    level = list(leaves)
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        level = [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def merkle_proof(leaves: List[bytes], index: int) -> List[Dict]:
+    """
+    Sibling hashes from the leaf at index up to the root, each tagged with the side it sits on.
+    """
+    proof = []
+    level = list(leaves)
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        sibling = index ^ 1
+        proof.append({'hash': level[sibling].hex(), 'side': 'left' if sibling < index else 'right'})
+        level = [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        index //= 2
+    return proof
+
+
+def verify_merkle_proof(leaf: bytes, proof: List[Dict], root: bytes) -> bool:
+    node = leaf
+    for step in proof:
+        sibling = bytes.fromhex(step['hash'])
+        node = _hash_pair(sibling, node) if step['side'] == 'left' else _hash_pair(node, sibling)
+    return node == root
@@ -0,0 +1,202 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Tuple
+
+# seconds, from a cached signature lookup up to a slow block
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    def labels(self, **labels) -> 'BoundMetric':
+        # resolves the label key once, for hot paths that always use the same labels
+        return BoundMetric(self, _labels(labels))
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self.samples():
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        self._inc(_labels(labels), amount)
+
+    def _inc(self, key: Labels, amount: float):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    Either set directly or read from callback, which is only called when the metrics are scraped.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, description: str, callback: Callable[[], float] = None):
+        super().__init__(name, description)
+        self.callback = callback
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, **labels):
+        self._set(_labels(labels), value)
+
+    def _set(self, key: Labels, value: float):
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        if self.callback is not None:
+            return [(self.name, (), self.callback())]
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per bucket counts with a final +Inf bucket, sum, count)
+        self._values: Dict[Labels, List] = {}
+
+    def observe(self, value: float, **labels):
+        self._observe(_labels(labels), value)
+
+    def _observe(self, key: Labels, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(_labels(labels))
+        return entry[2] if entry else 0
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        samples = []
+        with self._lock:
+            entries = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        for labels, counts, total, count in entries:
+            # buckets are cumulative in the exposition format
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', labels + (('le', _format_value(bound)),), cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, count))
+        return samples
+
+
+class BoundMetric:
+    def __init__(self, metric: Metric, key: Labels):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount: float = 1):
+        self.metric._inc(self.key, amount)
+
+    def set(self, value: float):
+        self.metric._set(self.key, value)
+
+    def observe(self, value: float):
+        self.metric._observe(self.key, value)
+
+
+class Registry:
+    """
+    Named metrics of one process. Updates only touch in-memory numbers,
+    the text exposition format is built when render is called.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str, callback: Callable[[], float] = None) -> Gauge:
+        gauge = self._get_or_create(Gauge, name, description)
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, description, buckets)
+
+    def get(self, name: str) -> Metric:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,166 @@
+import hashlib
+import multiprocessing as mp
+import queue
+import struct
+import threading
+import time
+import uuid
+from typing import Tuple, Dict
+from exceptions import MiningCancelledException
+
+CHUNK_SIZE = 4096
+BINARY_NONCE = struct.Struct('>Q')
+
+
+def _text_nonce(nonce: int) -> bytes:
+    return str(nonce).encode()
+
+
+class PrefixHasher:
+    """
+    SHA-256 over a fixed prefix followed by the nonce.
+    The prefix is hashed once, every nonce only clones that state and feeds in the nonce.
+    Legacy blocks append the nonce as decimal text, header blocks as a big-endian u64.
+    """
+
+    def __init__(self, prefix: bytes, binary_nonce: bool = False):
+        self._state = hashlib.sha256(prefix)
+        self._encode_nonce = BINARY_NONCE.pack if binary_nonce else _text_nonce
+
+    def hash(self, nonce: int) -> str:
+        h = self._state.copy()
+        h.update(self._encode_nonce(nonce))
+        return h.hexdigest()
+
+    def search(self, start: int, stop: int, difficulty: int) -> Tuple[int, str]:
+        # returns (-1, "") when no nonce in [start, stop) meets the difficulty
+        target = "0" * difficulty
+        state = self._state
+        encode_nonce = self._encode_nonce
+        for nonce in range(start, stop):
+            h = state.copy()
+            h.update(encode_nonce(nonce))
+            block_hash = h.hexdigest()
+            if block_hash[:difficulty] == target:
+                return nonce, block_hash
+        return -1, ""
+
+
+def _search(prefix: bytes, binary_nonce: bool, difficulty: int, worker_id: int, n_workers: int, chunk_size: int,
+            found, results, counters):
+    # worker i owns chunks i, i + n_workers, i + 2 * n_workers, ... so ranges never overlap
+    hasher = PrefixHasher(prefix, binary_nonce)
+    chunk = worker_id
+    tried = 0
+    while not found.is_set():
+        start = chunk * chunk_size
+        nonce, block_hash = hasher.search(start, start + chunk_size, difficulty)
+        if nonce >= 0:
+            counters[worker_id] = tried + nonce - start + 1
+            found.set()
+            results.put((nonce, block_hash))
+            return
+        tried += chunk_size
+        counters[worker_id] = tried
+        chunk += n_workers
+
+
+class MiningJob:
+    """
+    Status of one mining attempt, shared between the mining thread and whoever polls or cancels it.
+    """
+
+    def __init__(self, prev_hash: str = ""):
+        self.id = uuid.uuid4().hex
+        self.prev_hash = prev_hash
+        self.status = 'pending'
+        self.nonces_tried = 0
+        self.hash_rate = 0.0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.block_hash = None
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('succeeded', 'failed', 'cancelled')
+
+    def progress(self, nonces_tried: int):
+        self.nonces_tried = nonces_tried
+        self.hash_rate = hash_rate(nonces_tried, time.time() - self.started_at)
+
+    def finish(self, status: str, block_hash: str = None, error: str = None):
+        self.status = status
+        self.block_hash = block_hash
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'prev_hash': self.prev_hash,
+            'nonces_tried': self.nonces_tried,
+            'hash_rate': self.hash_rate,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'block_hash': self.block_hash,
+            'error': self.error
+        }
+
+
+def parallel_mine(prefix: bytes, difficulty: int, workers: int, chunk_size: int = CHUNK_SIZE,
+                  binary_nonce: bool = False, job: MiningJob = None) -> Tuple[int, str, int]:
+    """
+    Search the nonce space with a pool of processes.
+    Returns the winning nonce, its hash and the number of hashes computed by all workers.
+    Raises MiningCancelledException as soon as the job is cancelled.
+    """
+    ctx = mp.get_context()
+    found = ctx.Event()
+    results = ctx.Queue()
+    counters = ctx.Array('q', workers, lock=False)
+    processes = [
+        ctx.Process(
+            target=_search,
+            args=(prefix, binary_nonce, difficulty, worker_id, workers, chunk_size, found, results, counters),
+            daemon=True
+        ) for worker_id in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        while 1:
+            try:
+                nonce, block_hash = results.get(timeout=0.05)
+                break
+            except queue.Empty:
+                if job is not None:
+                    if job.cancelled:
+                        raise MiningCancelledException(f"Mining job {job.id} cancelled")
+                    job.progress(sum(counters))
+                if not any(p.is_alive() for p in processes):
+                    raise RuntimeError("All mining workers exited without a result")
+    finally:
+        found.set()
+        for p in processes:
+            p.join()
+    return nonce, block_hash, sum(counters)
+
+
+def hash_rate(hashes: int, time_cost: float) -> float:
+    return hashes / time_cost if time_cost > 0 else float(hashes)
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+    nonce, block_hash, hashes = parallel_mine(b"benchmark", difficulty=5, workers=mp.cpu_count())
+    print(f"nonce {nonce} hash {block_hash} hash rate {hash_rate(hashes, time.time() - start_time):.0f}/s")
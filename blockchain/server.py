@@ -1,12 +1,55 @@
-from flask import Flask, request, jsonify
-from blockchain_impl import BlockChain, Transaction
-from utils import generate_blockchain, deserialize_public_key, save_accounts_and_wallets
+from flask import Flask, request, jsonify, Response, g
+import json
+import time
+from blockchain_impl import Block, BlockChain, Transaction, Wallet, verify, signature_cache_info, DUPLICATE_TRANSACTIONS
+from exceptions import InvalidSignatureException, InsufficientFundsException, MiningInProgressException
+from custom_types import TX_VERSION_LEGACY
+from signatures import DEFAULT_SCHEME
+from codec import transaction_from_bytes, transaction_ids_from_bytes, deserialize_public_key, BLOCK_FRAME
+from client_utils import BINARY_CONTENT_TYPE, NDJSON_CONTENT_TYPE, HOP_LIMIT_HEADER, stream_blocks, sync_chain
+from gossip import HOP_LIMIT
+from block_store import BlockStore
+from metrics import registry
+from utils import generate_blockchain, save_accounts_and_wallets
 import fire
 import base64
 
+MAX_HEADERS = 2000
+MAX_PAGE_SIZE = 500
+MAX_BLOCKS = 1000
+
 app = Flask(__name__)
 blockchain: BlockChain = None
 
+REQUEST_SECONDS = registry.histogram('http_request_seconds', 'Request latency by route, method and status')
+# read from the node only when /metrics is scraped
+registry.gauge('chain_height', 'Height of the chain tip', lambda: len(blockchain.chain) - 1)
+registry.gauge('mempool_transactions', 'Pending transactions', lambda: len(blockchain.mempool))
+registry.gauge('mempool_bytes', 'Wire size of the pending transactions', lambda: blockchain.mempool.total_bytes)
+registry.gauge('broadcast_queue_depth', 'Transactions waiting to be sent to peers',
+               lambda: blockchain.broadcaster.queue_depth())
+registry.gauge('signature_cache_entries', 'Cached signature checks', lambda: signature_cache_info()['size'])
+
+
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    start_time = g.pop('start_time', None)
+    if start_time is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - start_time,
+                                route=route, method=request.method, status=response.status_code)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 
 @app.route('/blockchain/info', methods=['GET'])
 def chain_info():
@@ -14,49 +57,65 @@ def chain_info():
         'message':
             {
                 'chain_length': len(blockchain.chain),
-                'pending_transactions': len(blockchain.pending_transactions),
+                'tip': blockchain.chain[-1].block_hash,
+                'pending_transactions': len(blockchain.mempool),
+                'mempool_digest': blockchain.mempool.digest(),
                 'reward': blockchain.reward,
                 'difficulty': blockchain.difficulty,
-                'peers': blockchain.peers
+                'peers': blockchain.peers,
+                'signature_cache': signature_cache_info()
             }
     }), 200
 
 
 @app.route('/blockchain/mine', methods=['GET'])
 def mine():
-    data = request.get_json()
-    miner_addr_str = data['miner_addr']
-    miner_addr = deserialize_public_key(miner_addr_str)
     try:
-        blockchain.mine(miner_addr)
-        block_hash = blockchain.chain[-1].block_hash
-        return jsonify({'message': {
-            'status': 'success',
-            'block_hash': block_hash
-        }}), 200
+        data = request.get_json()
+        miner_addr = deserialize_public_key(data['miner_addr'])
+        workers = data.get('workers')
+        if workers is not None and (type(workers) is not int or workers < 1):
+            return jsonify({'error': f'Invalid workers {workers}, expecting a positive integer'}), 400
+        job = blockchain.start_mining(miner_addr, workers=workers)
+        return jsonify({'message': job.to_dict()}), 202
+    except MiningInProgressException as e:
+        return jsonify({'error': str(e), 'message': e.job.to_dict()}), 409
+    except KeyError as e:
+        return jsonify({'error': f'Missing key {str(e)}'}), 400
     except Exception as e:
         return jsonify({
             'err': str(e)
         }), 500
 
 
+@app.route('/blockchain/mine/<job_id>', methods=['GET'])
+def mining_job_status(job_id: str):
+    job = blockchain.mining_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown mining job {job_id}'}), 404
+    return jsonify({'message': job.to_dict()}), 200
+
+
+@app.route('/blockchain/mine/<job_id>', methods=['DELETE'])
+def cancel_mining_job(job_id: str):
+    job = blockchain.mining_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown mining job {job_id}'}), 404
+    job.cancel()
+    return jsonify({'message': job.to_dict()}), 200
+
+
 @app.route('/transaction/new', methods=['POST'])
 def add_new_transaction():
     try:
         data = request.get_json()
-        sender: str = str(data['sender'])
-        receiver: str = str(data['receiver'])
-        amount: int = int(data['amount'])
-        signature: bytes = base64.b64decode(data['signature'])
-        txn = Transaction(
-            deserialize_public_key(sender),
-            deserialize_public_key(receiver),
-            amount,
-            signature
-        )
-        blockchain.add_transaction(txn)
-        return jsonify({'message': "Transaction added successfully"}), 200
-    except ValueError as e:
+        txn = parse_transaction(data)
+        if not verify(txn.from_addr, txn):
+            return jsonify({'error': f'Invalid signature for transaction {txn.txid}'}), 400
+        if not blockchain.add_transaction(txn, hop_limit()):
+            return jsonify({'message': "Transaction already known", 'status': 'duplicate', 'txid': txn.txid}), 200
+        return jsonify({'message': "Transaction added successfully", 'status': 'accepted', 'txid': txn.txid}), 200
+    except (ValueError, TypeError) as e:
         return jsonify({'error': str(e)}), 400
     except KeyError as e:
         return jsonify({'error': f'Missing key {str(e)}'}), 400
@@ -64,16 +123,244 @@ def add_new_transaction():
         return jsonify({'error': f'Internal server error {e}'}), 500
 
 
-def main(port=5000, peer=None, reward=10, difficulty=1):
+@app.route('/transaction/batch', methods=['POST'])
+def add_transaction_batch():
+    if request.mimetype == BINARY_CONTENT_TYPE:
+        data = request.get_data()
+        try:
+            ids = transaction_ids_from_bytes(data)
+            results = [None] * len(ids)
+            parsed = []
+            for i, (offset, txid) in enumerate(ids):
+                # echoes of transactions this node already has are dropped before their keys are decoded
+                if txid is not None and blockchain.seen(txid):
+                    results[i] = {'status': 'duplicate', 'txid': txid}
+                    DUPLICATE_TRANSACTIONS.inc()
+                else:
+                    parsed.append((i, transaction_from_bytes(data, offset)[0]))
+        except Exception as e:
+            return jsonify({'error': f'Invalid transaction batch {e}'}), 400
+    else:
+        try:
+            items = request.get_json()['transactions']
+        except (KeyError, TypeError):
+            return jsonify({'error': 'Missing key transactions'}), 400
+        results = [None] * len(items)
+        parsed = []
+        for i, data in enumerate(items):
+            try:
+                parsed.append((i, parse_transaction(data)))
+            except KeyError as e:
+                results[i] = {'status': 'rejected', 'error': f'Missing key {str(e)}'}
+            except (ValueError, TypeError) as e:
+                results[i] = {'status': 'rejected', 'error': str(e)}
+    try:
+        statuses = blockchain.add_transactions([txn for _, txn in parsed], hop_limit())
+    except Exception as e:
+        return jsonify({'error': f'Internal server error {e}'}), 500
+    for (i, txn), status in zip(parsed, statuses):
+        results[i] = {'status': status, 'txid': txn.txid}
+    return jsonify({'results': results}), 200
+
+
+@app.route('/transaction/<txid>', methods=['GET'])
+def transaction_status(txid: str):
+    status = blockchain.transaction_status(txid)
+    if status['status'] == 'unknown':
+        return jsonify({'error': f'Unknown transaction {txid}'}), 404
+    return jsonify({'message': status}), 200
+
+
+@app.route('/transaction/<txid>/proof', methods=['GET'])
+def transaction_proof(txid: str):
+    try:
+        return jsonify({'message': blockchain.merkle_proof(txid)}), 200
+    except KeyError:
+        return jsonify({'error': f'Unknown transaction {txid}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@app.route('/headers', methods=['GET'])
+def headers():
+    try:
+        start = int(request.args.get('start', 0))
+        count = min(int(request.args.get('count', MAX_HEADERS)), MAX_HEADERS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start < 0:
+        return jsonify({'error': f'Invalid start {start}, expecting a height of at least 0'}), 400
+    return jsonify({'message': blockchain.headers(start, count)}), 200
+
+
+@app.route('/blocks', methods=['GET'])
+def blocks():
+    try:
+        start = int(request.args.get('start', 0))
+        count = min(int(request.args.get('count', MAX_BLOCKS)), MAX_BLOCKS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start < 0:
+        return jsonify({'error': f'Invalid start {start}, expecting a height of at least 0'}), 400
+    block_range = blockchain.chain[start:start + count]
+
+    if request.args.get('format', 'ndjson') == 'binary':
+        def generate():
+            for block in block_range:
+                payload = block.to_bytes()
+                yield BLOCK_FRAME.pack(len(payload)) + payload
+        return Response(generate(), mimetype=BINARY_CONTENT_TYPE)
+
+    def generate():
+        for height, block in enumerate(block_range, start):
+            yield json.dumps(dict(block.to_dict(), height=height)) + "\n"
+    return Response(generate(), mimetype=NDJSON_CONTENT_TYPE)
+
+
+@app.route('/block/new', methods=['POST'])
+def add_new_block():
+    try:
+        status = blockchain.receive_block(request.get_data(), hop_limit())
+    except (ValueError, InvalidSignatureException, InsufficientFundsException) as e:
+        return jsonify({'error': f'Invalid block {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Internal server error {e}'}), 500
+    return jsonify({'message': {'status': status}}), 200
+
+
+@app.route('/block/compact', methods=['POST'])
+def add_compact_block():
+    try:
+        status, missing = blockchain.receive_compact_block(request.get_data(), hop_limit())
+    except (ValueError, InvalidSignatureException, InsufficientFundsException) as e:
+        return jsonify({'error': f'Invalid block {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'Internal server error {e}'}), 500
+    return jsonify({'message': {'status': status, 'missing': missing}}), 200
+
+
+@app.route('/block/<block_hash>', methods=['GET'])
+def block_by_hash(block_hash: str):
+    block = blockchain.block_by_hash(block_hash)
+    if block is None:
+        return jsonify({'error': f'Unknown block {block_hash}'}), 404
+    return jsonify({'message': dict(
+        block.to_dict(),
+        height=blockchain.block_index[block_hash],
+        received_at=blockchain.block_received.get(block_hash)
+    )}), 200
+
+
+@app.route('/block/height/<int:height>', methods=['GET'])
+def block_by_height(height: int):
+    block = blockchain.block_at(height)
+    if block is None:
+        return jsonify({'error': f'No block at height {height}'}), 404
+    return jsonify({'message': dict(block.to_dict(), height=height)}), 200
+
+
+@app.route('/address/<fingerprint>/balance', methods=['GET'])
+def address_balance(fingerprint: str):
+    return jsonify({'message': {
+        'address': fingerprint,
+        'balance': blockchain.balance_of(fingerprint),
+        'height': len(blockchain.chain) - 1
+    }}), 200
+
+
+@app.route('/address/<fingerprint>/history', methods=['GET'])
+def address_history(fingerprint: str):
+    try:
+        page = int(request.args.get('page', 0))
+        page_size = min(int(request.args.get('page_size', 50)), MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if page < 0 or page_size <= 0:
+        return jsonify({'error': 'page must be >= 0 and page_size > 0'}), 400
+    return jsonify({'message': {
+        'address': fingerprint,
+        'page': page,
+        'page_size': page_size,
+        'total': len(blockchain.address_index.get(fingerprint, [])),
+        'history': blockchain.history(fingerprint, page, page_size)
+    }}), 200
+
+
+def hop_limit() -> int:
+    # peers send the hop limit left and can only lower it, requests from clients start at HOP_LIMIT
+    try:
+        return max(0, min(int(request.headers.get(HOP_LIMIT_HEADER, HOP_LIMIT)), HOP_LIMIT))
+    except ValueError:
+        return 0
+
+
+def parse_transaction(data: dict) -> Transaction:
+    sender: str = str(data['sender'])
+    receiver: str = str(data['receiver'])
+    amount: int = int(data['amount'])
+    signature: bytes = base64.b64decode(data['signature'])
+    # requests without a version come from clients signing the legacy PEM payload
+    version: int = int(data.get('version', TX_VERSION_LEGACY))
+    txn = Transaction(
+        deserialize_public_key(sender),
+        deserialize_public_key(receiver),
+        amount,
+        signature,
+        version=version
+    )
+    if 'ts' in data:
+        txn.ts = float(data['ts'])
+    elif version != TX_VERSION_LEGACY:
+        # later versions sign ts, without it the signature can never be checked
+        raise KeyError('ts')
+    return txn
+
+
+def main(port=5000, peers=None, reward=10, difficulty=1, workers=1, data_dir=None, sync=False, scheme=DEFAULT_SCHEME,
+         debug=True, peer=None):
+    """
+    peers is one port or a list of ports of local nodes to gossip with, with sync the genesis
+    block is fetched from the first one and the chain from all that answer. peer is the single
+    peer flag of earlier versions, kept so existing --peer invocations keep working.
+    """
     global blockchain
-    blockchain, accounts, wallets = generate_blockchain(3, 5, 3, reward=reward, difficulty=difficulty)
-    if peer:
+    peers = [] if peers is None else list(peers) if isinstance(peers, (list, tuple)) else [peers]
+    if peer is not None and peer not in peers:
+        peers.insert(0, peer)
+    store = BlockStore(data_dir) if data_dir else None
+    if store is not None and len(store) > 0:
+        blockchain = BlockChain(chain=store.load_chain(), reward=reward, difficulty=difficulty, store=store)
+        validated = blockchain.validate_chain(checkpoints=[store.load_checkpoint()], workers=workers)
+        store.save_checkpoint(len(blockchain.chain) - 1)
+        print('resumed chain from', data_dir, 'at height', len(blockchain.chain) - 1, 'validated', validated, 'blocks')
+    elif sync and peers:
+        # adopt the peer's genesis block, everything after it is verified while syncing
+        genesis_payload = next(stream_blocks('http://localhost', peers[0], 0, 1))
+        genesis = Block.from_bytes(genesis_payload, None)
+        if store is not None:
+            store.append(genesis)
+        blockchain = BlockChain(chain=[genesis], reward=reward, difficulty=difficulty, store=store)
+    else:
+        # the genesis wallets get fresh keys, never ones from the shared fixture pool
+        wallets = [Wallet(scheme=scheme) for _ in range(3)]
+        blockchain, accounts, wallets = generate_blockchain(3, 5, 3, reward=reward, difficulty=difficulty, scheme=scheme,
+                                                            wallets=wallets)
+        if store is not None:
+            store.extend(blockchain.chain)
+            blockchain.store = store
+        save_accounts_and_wallets(accounts, wallets)
+    blockchain.mining_workers = workers
+    for peer in peers:
         blockchain.add_peer(('http://localhost', peer))
+    if sync and blockchain.peers:
+        # later peers may not be up yet when a cluster starts, sync_chain skips those
+        print('synced', sync_chain(blockchain, blockchain.peers), 'blocks from', blockchain.peers)
+        if store is not None:
+            store.save_checkpoint(len(blockchain.chain) - 1)
 
-    save_accounts_and_wallets(accounts, wallets)
-    print('chain info:', blockchain.difficulty, blockchain.peers)
+    print('chain info:', blockchain.difficulty, blockchain.peers, blockchain.mining_workers)
 
-    app.run(debug=True, port=port)
+    app.run(debug=debug, port=port, threaded=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,155 @@
+from typing import Dict, Tuple
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, ed25519
+
+RSA = 'rsa'
+ED25519 = 'ed25519'
+DEFAULT_SCHEME = RSA
+
+ED25519_KEY_SIZE = 32
+
+
+class SignatureScheme:
+    """
+    Key generation, signing, verification and key encodings of one signature algorithm.
+    Keys are the cryptography library key objects.
+    """
+    name = ''
+    # stable id for binary formats
+    code = 0
+
+    def generate(self) -> Tuple:
+        # (private key, public key)
+        raise NotImplementedError
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def verify(self, public_key, data: bytes, signature: bytes) -> bool:
+        raise NotImplementedError
+
+    def public_bytes(self, public_key) -> bytes:
+        return public_key.public_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+
+    def private_pem(self, private_key) -> str:
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        ).decode('utf-8')
+
+    def private_bytes(self, private_key) -> bytes:
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+
+    def load_private_bytes(self, data: bytes):
+        return serialization.load_der_private_key(data, password=None)
+
+
+class RSAScheme(SignatureScheme):
+    # 2048 bit RSA-PSS over SHA-256, public keys are DER encoded
+    name = RSA
+    code = 1
+    key_size = 2048
+
+    def generate(self) -> Tuple:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=self.key_size)
+        return private_key, private_key.public_key()
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(data, _pss(), hashes.SHA256())
+
+    def verify(self, public_key, data: bytes, signature: bytes) -> bool:
+        try:
+            public_key.verify(signature=signature, data=data, padding=_pss(), algorithm=hashes.SHA256())
+            return True
+        except InvalidSignature:
+            return False
+
+    def private_pem(self, private_key) -> str:
+        # the format wallets were always saved in
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.TraditionalOpenSSL,
+            encryption_algorithm=serialization.NoEncryption()
+        ).decode('utf-8')
+
+
+class Ed25519Scheme(SignatureScheme):
+    # 64 byte signatures, public keys are the raw 32 bytes
+    name = ED25519
+    code = 2
+
+    def generate(self) -> Tuple:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        return private_key, private_key.public_key()
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(data)
+
+    def verify(self, public_key, data: bytes, signature: bytes) -> bool:
+        try:
+            public_key.verify(signature, data)
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_bytes(self, public_key) -> bytes:
+        return public_key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+
+    def private_bytes(self, private_key) -> bytes:
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PrivateFormat.Raw,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+
+    def load_private_bytes(self, data: bytes):
+        return ed25519.Ed25519PrivateKey.from_private_bytes(data)
+
+
+def _pss() -> padding.PSS:
+    return padding.PSS(
+        mgf=padding.MGF1(hashes.SHA256()),
+        salt_length=padding.PSS.MAX_LENGTH
+    )
+
+
+schemes: Dict[str, SignatureScheme] = {
+    RSA: RSAScheme(),
+    ED25519: Ed25519Scheme()
+}
+schemes_by_code: Dict[int, SignatureScheme] = {scheme.code: scheme for scheme in schemes.values()}
+
+
+def get_scheme(name: str) -> SignatureScheme:
+    try:
+        return schemes[name]
+    except KeyError:
+        raise ValueError(f"Unknown signature scheme {name}, expecting one of {', '.join(schemes)}")
+
+
+def scheme_for_key(key) -> SignatureScheme:
+    # works for both private and public key objects
+    if isinstance(key, (ed25519.Ed25519PublicKey, ed25519.Ed25519PrivateKey)):
+        return schemes[ED25519]
+    if isinstance(key, (rsa.RSAPublicKey, rsa.RSAPrivateKey)):
+        return schemes[RSA]
+    raise ValueError(f"Unsupported key type {type(key).__name__}")
+
+
+def load_public_bytes(data: bytes):
+    # raw Ed25519 keys have a fixed size, everything else is DER
+    if len(data) == ED25519_KEY_SIZE:
+        return ed25519.Ed25519PublicKey.from_public_bytes(data)
+    return serialization.load_der_public_key(data)
@@ -0,0 +1,21 @@
+from unittest import TestCase
+from benchmark import compare, result
+
+
+class TestBenchmark(TestCase):
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        baseline = [
+            result('throughput', 100.0, 'txns/s', True, size=1),
+            result('latency', 10.0, 'us', False, size=1),
+            result('latency', 10.0, 'us', False, size=2)
+        ]
+        results = [
+            result('throughput', 70.0, 'txns/s', True, size=1),
+            result('latency', 12.0, 'us', False, size=1),
+            result('latency', 14.0, 'us', False, size=2),
+            result('latency', 99.0, 'us', False, size=3)
+        ]
+        regressions = compare(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('throughput[size=1]'))
+        self.assertTrue(regressions[1].startswith('latency[size=2]'))
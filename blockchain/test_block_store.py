@@ -0,0 +1,60 @@
+import os
+import tempfile
+from unittest import TestCase
+from block_store import BlockStore, INDEX_FILE, LOG_FILE, decode_block
+from blockchain_impl import BlockChain
+from wallet_pool import take_wallets
+from utils import generate_blockchain, generate_signed_transaction
+
+
+class TestBlockStore(TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.blockchain, self.accounts, self.wallets = generate_blockchain(length=3, n_transactions=2, n_users=3)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_reopen_resumes_at_tip(self):
+        store = BlockStore(self.dir.name)
+        store.extend(self.blockchain.chain)
+        self.blockchain.store = store
+        self.blockchain.add_transaction(generate_signed_transaction(self.wallets[0], self.wallets[1], 1))
+        self.blockchain.mine(take_wallets(1)[0].public_key)
+        store.close()
+
+        reopened = BlockStore(self.dir.name)
+        chain = reopened.load_chain()
+        self.assertEqual([b.block_hash for b in chain], [b.block_hash for b in self.blockchain.chain])
+        self.assertEqual(chain[-1].prev_block, chain[-2])
+        self.assertEqual(chain[-2].next_block, chain[-1])
+        resumed = BlockChain(chain=chain, reward=10, difficulty=1, store=reopened)
+        self.assertEqual(resumed.balances, self.blockchain.balances)
+        resumed.verify_block_hash(chain[-1])
+        self.assertEqual(decode_block(reopened.read(1), chain[0]).block_hash, chain[1].block_hash)
+
+    def test_partial_append_is_dropped(self):
+        store = BlockStore(self.dir.name)
+        store.extend(self.blockchain.chain)
+        store.close()
+        with open(os.path.join(self.dir.name, LOG_FILE), 'ab') as f:
+            f.write(b'\x00\x00\x10\x00{"partial')
+        with open(os.path.join(self.dir.name, INDEX_FILE), 'ab') as f:
+            f.write(os.path.getsize(os.path.join(self.dir.name, LOG_FILE)).to_bytes(8, 'big')[:5])
+
+        reopened = BlockStore(self.dir.name)
+        self.assertEqual(len(reopened), 3)
+        self.assertEqual(len(reopened.load_chain()), 3)
+        reopened.append(self.blockchain.chain[-1])
+        self.assertEqual(len(BlockStore(self.dir.name)), 4)
+
+    def test_checkpoint_round_trip(self):
+        store = BlockStore(self.dir.name)
+        self.assertEqual(store.load_checkpoint(), 0)
+        store.extend(self.blockchain.chain)
+        store.save_checkpoint(2)
+        store.close()
+        reopened = BlockStore(self.dir.name)
+        self.assertEqual(reopened.load_checkpoint(), 2)
+        resumed = BlockChain(chain=reopened.load_chain(), reward=10, difficulty=1, store=reopened)
+        self.assertEqual(resumed.validate_chain(checkpoints=[reopened.load_checkpoint()], workers=1), 0)
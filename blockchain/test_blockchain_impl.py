@@ -1,33 +1,109 @@
 import random
+import time
 from unittest import TestCase
-from blockchain_impl import Block, verify, verify_transaction_has_sufficient_funds
-from custom_types import Wallet
+from blockchain_impl import Block, verify, verify_transaction_has_sufficient_funds, compute_balances, \
+    hash_block, mining_hasher, verify_batch, signature_cache, block_merkle_root, BLOCK_VERSION_LEGACY
+from header import HEADER_SIZE
+from mining import PrefixHasher
+from custom_types import Wallet, GenesisPublicKey, Transaction, TX_VERSION_LEGACY, SIGNING_PAYLOAD
+from codec import transaction_to_bytes, transaction_from_bytes, deserialize_public_key
 from exceptions import *
-from utils import generate_signed_transaction, generate_blockchain, generate_random_hash
+from wallet_pool import take_wallets
+from utils import generate_signed_transaction, generate_blockchain, generate_random_hash, \
+    deserialize_private_key
+from signatures import ED25519
 
 
 class TestWallet(TestCase):
     def setUp(self) -> None:
-        self.wallet_a = Wallet()
-        self.wallet_b = Wallet()
+        self.wallet_a, self.wallet_b = take_wallets(2)
 
     def test_verify_legit_transaction(self):
         txn = generate_signed_transaction(self.wallet_a, self.wallet_b)
         got = verify(self.wallet_a.public_key, txn)
         self.assertEqual(got, True)
 
+    def test_identical_payments_get_distinct_txids(self):
+        first, second = [self.wallet_a.sign(Transaction(self.wallet_a.public_key, self.wallet_b.public_key, 5))
+                         for _ in range(2)]
+        self.assertNotEqual(first.ts, second.ts)
+        self.assertNotEqual(first.txid, second.txid)
+
     def test_verify_illegal_transaction(self):
         txn = generate_signed_transaction(self.wallet_a, self.wallet_b)
         txn.signature = b'123'
         got = verify(self.wallet_a.public_key, txn)
         self.assertEqual(got, False)
 
+    def test_verify_legacy_transaction(self):
+        txn = self.wallet_a.sign(Transaction(
+            self.wallet_a.public_key,
+            self.wallet_b.public_key,
+            amount=10,
+            version=TX_VERSION_LEGACY
+        ))
+        self.assertEqual(txn.encode(), (str(txn.from_addr) + str(txn.to_addr) + "10").encode())
+        self.assertEqual(txn.hash_bytes(), str(txn).encode())
+        self.assertEqual(verify(self.wallet_a.public_key, txn), True)
+
+    def test_compact_transaction_round_trip(self):
+        txn = generate_signed_transaction(self.wallet_a, self.wallet_b, 10)
+        self.assertEqual(len(txn.encode()), SIGNING_PAYLOAD.size)
+        data = transaction_to_bytes(txn)
+        decoded, offset = transaction_from_bytes(data)
+        self.assertEqual(offset, len(data))
+        self.assertEqual(decoded, txn)
+        self.assertEqual(decoded.ts, txn.ts)
+        self.assertEqual(decoded.txid, txn.txid)
+        self.assertEqual(verify(decoded.from_addr, decoded), True)
+
+    def test_public_key_identity(self):
+        same_key = deserialize_public_key(str(self.wallet_a.public_key))
+        self.assertEqual(same_key, self.wallet_a.public_key)
+        self.assertNotEqual(self.wallet_a.public_key, self.wallet_b.public_key)
+        self.assertEqual(len({same_key, self.wallet_a.public_key, self.wallet_b.public_key}), 2)
+        self.assertEqual(len(same_key.fingerprint), 40)
+        self.assertNotEqual(GenesisPublicKey(None), self.wallet_a.public_key)
+
+    def test_ed25519_wallet(self):
+        wallet_c = Wallet(scheme=ED25519)
+        txn = generate_signed_transaction(wallet_c, self.wallet_a, amount=3)
+        self.assertEqual(len(wallet_c.public_key.to_bytes()), 32)
+        self.assertEqual(len(txn.signature), 64)
+        self.assertTrue(verify(wallet_c.public_key, txn))
+        decoded, _ = transaction_from_bytes(transaction_to_bytes(txn))
+        self.assertEqual(decoded.from_addr, wallet_c.public_key)
+        self.assertTrue(verify(decoded.from_addr, decoded))
+        self.assertEqual(deserialize_public_key(str(wallet_c.public_key)), wallet_c.public_key)
+        restored = deserialize_private_key(str(wallet_c.private_key))
+        self.assertTrue(verify(wallet_c.public_key, restored.sign(Transaction(wallet_c.public_key, self.wallet_b.public_key, 1))))
+        txn.amount += 1
+        self.assertFalse(verify(wallet_c.public_key, txn))
+
+    def test_verify_uses_signature_cache(self):
+        txn = generate_signed_transaction(self.wallet_a, self.wallet_b)
+        self.assertEqual(verify(self.wallet_a.public_key, txn), True)
+        hits, misses = signature_cache.hits, signature_cache.misses
+        self.assertEqual(verify(self.wallet_a.public_key, txn), True)
+        self.assertEqual(signature_cache.hits, hits + 1)
+        self.assertEqual(signature_cache.misses, misses)
+
+        txn.signature = b'123'
+        self.assertEqual(verify(self.wallet_a.public_key, txn), False)
+        self.assertEqual(signature_cache.misses, misses + 1)
+
+    def test_verify_batch_returns_all_invalid_transactions(self):
+        txns = [generate_signed_transaction(self.wallet_a, self.wallet_b) for _ in range(4)]
+        txns[1].signature = b'123'
+        txns[3].signature = b'456'
+        for workers in [1, 4]:
+            got = verify_batch(txns, workers=workers)
+            self.assertEqual(got, [txns[1], txns[3]])
+
 
 class TestBlock(TestCase):
     prev_hash = generate_random_hash()
-    wa = Wallet()
-    wb = Wallet()
-    wc = Wallet()
+    wa, wb, wc = take_wallets(3)
     reward = 10
     difficulty = 2
 
@@ -48,7 +124,7 @@ class TestBlock(TestCase):
             reward=self.reward,
             difficulty=self.difficulty
         )
-        self.miner = Wallet()
+        self.miner, = take_wallets(1)
 
     def test_mine(self):
         self.block.mine(
@@ -57,6 +133,43 @@ class TestBlock(TestCase):
 
         self.assertEqual(self.block.block_hash[:self.difficulty], "0" * self.difficulty)
 
+    def test_mining_hasher_matches_hash_block(self):
+        coinbase = self.block._generate_coinbase_transaction(self.reward, self.miner.public_key)
+        hasher = mining_hasher(self.prev_hash, self.block.transactions, coinbase)
+        for nonce in [0, 1, 9, 10, 12345]:
+            self.assertEqual(
+                hasher.hash(nonce),
+                hash_block(self.prev_hash, self.block.transactions, coinbase, nonce)
+            )
+
+    def test_mine_legacy_block_finds_lowest_valid_nonce(self):
+        block = Block(
+            prev_block=self.prev_block,
+            transactions=[generate_signed_transaction(self.wa, self.wb, 80)],
+            reward=self.reward,
+            difficulty=self.difficulty,
+            version=BLOCK_VERSION_LEGACY
+        )
+        block.mine(miner_addr=self.miner.public_key)
+        coinbase = block.coin_base_transaction
+        for nonce in range(block.nonce):
+            block_hash = hash_block(self.prev_block.block_hash, block.transactions, coinbase, nonce)
+            self.assertNotEqual(block_hash[:self.difficulty], "0" * self.difficulty)
+        self.assertEqual(
+            block.block_hash,
+            hash_block(self.prev_block.block_hash, block.transactions, coinbase, block.nonce)
+        )
+
+    def test_mine_hashes_fixed_size_header(self):
+        self.block.mine(miner_addr=self.miner.public_key)
+        header = self.block.header()
+        self.assertEqual(len(header.serialize()), HEADER_SIZE)
+        self.assertEqual(self.block.block_hash, header.hash())
+        self.assertEqual(
+            self.block.merkle_root,
+            block_merkle_root(self.block.transactions, self.block.coin_base_transaction)
+        )
+
     def test_verify_signed_transaction(self):
         signed_txn = generate_signed_transaction(self.wa, self.wb)
         self.block.verify_signature(signed_txn)
@@ -152,16 +265,30 @@ class TestBlock(TestCase):
 
 
 class TestBlockChain(TestCase):
-    wa = Wallet()
-    wb = Wallet()
-    wc = Wallet()
-    wm = Wallet()
+    wa, wb, wc, wm = take_wallets(4)
     reward = 10
     difficulty = 2
 
     def setUp(self) -> None:
         pass
 
+    def test_mine_drops_unmineable_transactions(self):
+        blockchain, accounts, wallets = generate_blockchain(length=2, n_transactions=1, n_users=3)
+        valid = generate_signed_transaction(wallets[0], wallets[1], amount=1, ts=1)
+        forged = generate_signed_transaction(wallets[1], wallets[2], amount=1, ts=2)
+        forged.signature = b'forged'
+        overspend = generate_signed_transaction(wallets[2], wallets[0], amount=accounts[2] + 1, ts=3)
+        for txn in (valid, forged, overspend):
+            blockchain.add_transaction(txn)
+        block = blockchain.mine(self.wm.public_key)
+        self.assertIsNotNone(block)
+        self.assertEqual(block.transactions, [valid])
+        self.assertEqual(len(blockchain.mempool), 0)
+        # an underfunded transfer can be sent again, a forged one stays a duplicate
+        self.assertEqual(blockchain.transaction_status(overspend.txid)['status'], 'unknown')
+        self.assertTrue(blockchain.add_transaction(overspend))
+        self.assertFalse(blockchain.add_transaction(forged))
+
     def test_mine_succeed_with_valid_block(self):
         blockchain, accounts, wallets = generate_blockchain(length=3, n_transactions=1, n_users=3)
         blockchain.add_transaction(generate_signed_transaction(
@@ -175,7 +302,7 @@ class TestBlockChain(TestCase):
         self.assertEqual(new_last_block.prev_block, last_block)
         self.assertEqual(last_block.next_block, new_last_block)
 
-    def test_mine_fails_with_invalid_block(self):
+    def test_mine_drops_invalid_transaction(self):
         blockchain, accounts, wallets = generate_blockchain(length=3, n_transactions=1, n_users=3)
         txn = generate_signed_transaction(
             wallets[0],
@@ -185,10 +312,10 @@ class TestBlockChain(TestCase):
         txn.signature = b'0x0'
 
         blockchain.add_transaction(txn)
-        last_block = blockchain.chain[-1]
         blockchain.mine(self.wm.public_key)
-        new_last_block = blockchain.chain[-1]
-        self.assertEqual(new_last_block, last_block)
+        # the forged transaction is dropped, it never reaches the chain
+        self.assertNotIn(txn.txid, blockchain.transaction_index)
+        self.assertNotIn(txn.txid, blockchain.mempool)
 
     def test_verify_correct_block(self):
         blockchain, accounts, wallets = generate_blockchain(
@@ -237,5 +364,168 @@ class TestBlockChain(TestCase):
             reward=self.reward,
             difficulty=self.difficulty
         )
-        with self.assertRaises(InvalidSignatureException):
+        with self.assertRaises(InvalidSignatureException) as ctx:
             blockchain.verify_block(other)
+        self.assertEqual(ctx.exception.invalid_transactions, [invalid_txn])
+
+    def test_balances_follow_added_blocks(self):
+        blockchain, accounts, wallets = generate_blockchain(length=3, n_transactions=2, n_users=3)
+        self.assertEqual(blockchain.balances, compute_balances(blockchain.chain[-1]))
+        blockchain.add_transaction(generate_signed_transaction(
+            wallets[0],
+            wallets[1],
+            amount=accounts[0]
+        ))
+        blockchain.mine(self.wm.public_key)
+        self.assertEqual(len(blockchain.chain), 4)
+        self.assertEqual(blockchain.balances, compute_balances(blockchain.chain[-1]))
+        self.assertEqual(blockchain.balances[wallets[0].public_key.fingerprint], 0)
+
+    def test_verify_block_with_insufficient_funds(self):
+        blockchain, accounts, wallets = generate_blockchain(
+            length=3,
+            n_transactions=1,
+            n_users=3,
+            reward=self.reward,
+            difficulty=self.difficulty
+        )
+        other = Block(
+            prev_block=blockchain.chain[-1],
+            transactions=[
+                generate_signed_transaction(wallets[0], wallets[1], amount=accounts[0] + 1)
+            ],
+            reward=self.reward,
+            difficulty=self.difficulty
+        )
+        with self.assertRaises(InsufficientFundsException):
+            blockchain.verify_block(other)
+
+    def test_parallel_mine(self):
+        blockchain, accounts, wallets = generate_blockchain(
+            length=2,
+            n_transactions=1,
+            n_users=3,
+            reward=self.reward,
+            difficulty=self.difficulty
+        )
+        blockchain.add_transaction(generate_signed_transaction(wallets[0], wallets[1], amount=1))
+        blockchain.mine(self.wm.public_key, workers=2)
+        new_block = blockchain.chain[-1]
+        self.assertEqual(len(blockchain.chain), 3)
+        self.assertEqual(new_block.block_hash[:self.difficulty], "0" * self.difficulty)
+        self.assertGreater(new_block.hash_rate, 0)
+        blockchain.verify_block_hash(new_block)
+
+    def test_verify_mined_block_hits_signature_cache(self):
+        blockchain, accounts, wallets = generate_blockchain(
+            length=2,
+            n_transactions=1,
+            n_users=3,
+            reward=self.reward,
+            difficulty=self.difficulty
+        )
+        other = Block(
+            prev_block=blockchain.chain[-1],
+            transactions=[generate_signed_transaction(wallets[0], wallets[1], amount=1)],
+            reward=self.reward,
+            difficulty=self.difficulty
+        )
+        other.mine(self.wa.public_key)
+        misses = signature_cache.misses
+        blockchain.verify_block(other)
+        self.assertEqual(signature_cache.misses, misses)
+
+    def test_verify_block_with_tampered_transaction(self):
+        blockchain, accounts, wallets = generate_blockchain(
+            length=2,
+            n_transactions=1,
+            n_users=3,
+            reward=self.reward,
+            difficulty=self.difficulty
+        )
+        other = Block(
+            prev_block=blockchain.chain[-1],
+            transactions=[generate_signed_transaction(wallets[0], wallets[1], amount=1)],
+            reward=self.reward,
+            difficulty=self.difficulty
+        )
+        other.mine(self.wa.public_key)
+        other.coin_base_transaction.amount += 1
+        with self.assertRaises(ValueError):
+            blockchain.verify_block_hash(other)
+
+    def test_background_mining_job(self):
+        blockchain, accounts, wallets = generate_blockchain(length=2, n_transactions=1, n_users=3)
+        blockchain.add_transaction(generate_signed_transaction(wallets[0], wallets[1], amount=1))
+        job = blockchain.start_mining(self.wm.public_key)
+        deadline = time.time() + 30
+        while not job.done and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.block_hash, blockchain.chain[-1].block_hash)
+        self.assertGreater(job.nonces_tried, 0)
+
+    def test_mining_job_cancelled_when_tip_changes(self):
+        blockchain, accounts, wallets = generate_blockchain(length=2, n_transactions=1, n_users=3)
+        blockchain.difficulty = 12
+        job = blockchain.start_mining(self.wm.public_key)
+        while job.status == 'pending':
+            time.sleep(0.01)
+        competing = Block(prev_block=blockchain.chain[-1], transactions=[], reward=10, difficulty=1)
+        competing.mine(self.wa.public_key)
+        blockchain.add_block(competing)
+        deadline = time.time() + 10
+        while not job.done and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(job.status, 'cancelled')
+        self.assertEqual(blockchain.chain[-1], competing)
+
+    def test_validate_chain(self):
+        blockchain, accounts, wallets = generate_blockchain(length=4, n_transactions=2, n_users=3)
+        self.assertEqual(blockchain.validate_chain(workers=1), 3)
+        self.assertEqual(blockchain.validate_chain(workers=2), 3)
+        self.assertEqual(blockchain.validate_chain(checkpoints=[1, 2, 10], workers=1), 1)
+
+    def test_validate_chain_after_checkpoint(self):
+        blockchain, accounts, wallets = generate_blockchain(length=4, n_transactions=2, n_users=3)
+        blockchain.chain[2].transactions[0].signature = b'forged'
+        with self.assertRaises(ValueError):
+            blockchain.validate_chain(workers=1)
+        # blocks up to a trusted checkpoint are not looked at again
+        self.assertEqual(blockchain.validate_chain(checkpoints=[2], workers=1), 1)
+
+    def test_validate_chain_rejects_forged_signature(self):
+        blockchain, accounts, wallets = generate_blockchain(length=2, n_transactions=1, n_users=3)
+        txn = generate_signed_transaction(wallets[0], wallets[1], amount=1)
+        block = Block(prev_block=blockchain.chain[-1], transactions=[txn], reward=10, difficulty=1)
+        block.mine(self.wm.public_key)
+        # re-sign with another wallet and re-mine so only the signature is wrong
+        wallets[2].sign(txn)
+        block.merkle_root = block_merkle_root(block.transactions, block.coin_base_transaction)
+        block.nonce, block.block_hash = PrefixHasher(block.header().prefix(), True).search(0, 1 << 20, 1)
+        blockchain.chain[-1].next_block = block
+        blockchain.chain.append(block)
+        with self.assertRaises(InvalidSignatureException) as ctx:
+            blockchain.validate_chain(workers=1)
+        self.assertEqual(len(ctx.exception.invalid_transactions), 1)
+
+    def test_validate_chain_checks_difficulty_and_reward(self):
+        for difficulty, reward in ((0, 10), (1, 1000)):
+            blockchain, accounts, wallets = generate_blockchain(length=2, n_transactions=1, n_users=3)
+            block = Block(prev_block=blockchain.chain[-1], transactions=[], reward=reward, difficulty=difficulty)
+            block.mine(self.wm.public_key)
+            blockchain.chain[-1].next_block = block
+            blockchain.chain.append(block)
+            with self.assertRaises(ValueError):
+                blockchain.validate_chain(workers=1)
+
+    def test_validate_chain_with_mixed_schemes(self):
+        blockchain, accounts, wallets = generate_blockchain(length=3, n_transactions=2, n_users=3, scheme=ED25519)
+        rsa_wallet, = take_wallets(1)
+        blockchain.add_transaction(generate_signed_transaction(wallets[0], rsa_wallet, amount=1))
+        blockchain.mine(self.wm.public_key)
+        blockchain.add_transaction(generate_signed_transaction(rsa_wallet, wallets[1], amount=1))
+        blockchain.add_transaction(generate_signed_transaction(wallets[1], wallets[2], amount=1))
+        blockchain.mine(self.wm.public_key)
+        self.assertEqual(len(blockchain.chain), 5)
+        self.assertEqual(blockchain.validate_chain(workers=2), 4)
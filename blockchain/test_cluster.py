@@ -0,0 +1,17 @@
+from unittest import TestCase
+from cluster import topology
+
+
+class TestCluster(TestCase):
+    def test_topologies(self):
+        self.assertEqual(topology('ring', 4), [[1, 3], [0, 2], [1, 3], [0, 2]])
+        self.assertEqual(topology('ring', 2), [[1], [0]])
+        self.assertEqual(topology('mesh', 3), [[1, 2], [0, 2], [0, 1]])
+        self.assertEqual(topology('star', 3), [[1, 2], [0], [0]])
+        with self.assertRaises(ValueError):
+            topology('tree', 3)
+
+    def test_every_node_bootstraps_from_an_earlier_one(self):
+        for name in ('ring', 'mesh', 'star'):
+            for i, peers in enumerate(topology(name, 5)[1:], 1):
+                self.assertLess(peers[0], i)
@@ -0,0 +1,53 @@
+from unittest import TestCase, mock
+from wallet_pool import take_wallets
+from gossip import Broadcaster, BlockRelay
+from utils import generate_signed_transaction
+
+
+class TestBroadcaster(TestCase):
+    wa, wb = take_wallets(2)
+
+    def test_sends_to_every_peer(self):
+        peers = [('http://localhost', 5001), ('http://localhost', 5002)]
+        broadcaster = Broadcaster(peers)
+        txn = generate_signed_transaction(self.wa, self.wb, 10)
+        with mock.patch('gossip.add_transactions') as add_transaction:
+            broadcaster.submit(txn)
+            broadcaster.flush()
+        self.assertEqual(sorted(call.kwargs['port'] for call in add_transaction.call_args_list), [5001, 5002])
+
+    def test_retries_failed_send(self):
+        broadcaster = Broadcaster([('http://localhost', 5001)], backoff=0)
+        txn = generate_signed_transaction(self.wa, self.wb, 10)
+        with mock.patch('gossip.add_transactions', side_effect=[Exception("down"), None]) as add_transaction:
+            broadcaster.submit(txn)
+            broadcaster.flush()
+        self.assertEqual(add_transaction.call_count, 2)
+
+    def test_no_peers_is_noop(self):
+        broadcaster = Broadcaster([])
+        broadcaster.submit(generate_signed_transaction(self.wa, self.wb, 10))
+        self.assertEqual(broadcaster.queue_depth(), 0)
+
+    def test_hop_limit_is_forwarded(self):
+        broadcaster = Broadcaster([('http://localhost', 5001)])
+        txns = [generate_signed_transaction(self.wa, self.wb, 10, ts=i) for i in range(3)]
+        accepted = {'status': 'accepted', 'missing': []}
+        with mock.patch('gossip.add_transactions') as add_transactions, \
+                mock.patch('gossip.add_compact_block', return_value=accepted) as add_compact_block:
+            sender = broadcaster.senders()[0]
+            # one request per run of equal hop limits, in queue order
+            sender.send([(txns[0], 3), (txns[1], 3), (txns[2], 2), (BlockRelay(b'block', txns), 5)])
+        self.assertEqual([(call.kwargs['transactions'], call.kwargs['hop_limit']) for call in add_transactions.call_args_list],
+                         [(txns[:2], 3), (txns[2:], 2)])
+        self.assertEqual(add_compact_block.call_args.kwargs['hop_limit'], 5)
+
+    def test_compact_block_sends_missing_transactions(self):
+        broadcaster = Broadcaster([('http://localhost', 5001)])
+        txns = [generate_signed_transaction(self.wa, self.wb, 10, ts=i) for i in range(3)]
+        responses = [{'status': 'missing', 'missing': [1]}, {'status': 'accepted', 'missing': []}]
+        with mock.patch('gossip.add_compact_block', side_effect=responses) as add_compact_block:
+            broadcaster.submit_block(BlockRelay(b'block', txns))
+            broadcaster.flush()
+        self.assertEqual([call.kwargs['transactions'] for call in add_compact_block.call_args_list],
+                         [[], [(1, txns[1])]])
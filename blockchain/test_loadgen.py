@@ -0,0 +1,53 @@
+import threading
+from unittest import TestCase
+from werkzeug.serving import make_server
+import server
+from loadgen import LoadGenerator, MiningTrigger, percentile, presign
+from utils import generate_blockchain
+
+
+class TestLoadGen(TestCase):
+    def setUp(self) -> None:
+        self.blockchain, self.accounts, self.wallets = generate_blockchain(length=2, n_transactions=1, n_users=3)
+        server.blockchain = self.blockchain
+        self.http = make_server('localhost', 0, server.app, threaded=True)
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+
+    def tearDown(self) -> None:
+        self.http.shutdown()
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_load_and_mining(self):
+        transactions = presign(self.wallets, 40)
+        self.assertEqual(len({txn.txid for txn in transactions}), 40)
+        trigger = MiningTrigger('http://localhost', self.http.server_port, str(self.wallets[0].public_key), 0.2)
+        trigger.start()
+        report = LoadGenerator('http://localhost', self.http.server_port, transactions[:30], tps=100,
+                               connections=4).run()
+        batched = LoadGenerator('http://localhost', self.http.server_port, transactions[30:], tps=100,
+                                connections=2, batch=5).run()
+        trigger.stop()
+        self.assertEqual(report['errors'], {})
+        self.assertEqual(report['transactions'], 30)
+        self.assertEqual(batched['requests'], 2)
+        self.assertEqual(batched['transactions'], 10)
+        self.assertGreater(report['achieved_tps'], 0)
+        self.assertLessEqual(report['latency_ms']['p50'], report['latency_ms']['p99'])
+        self.assertGreater(trigger.summary().get('succeeded', 0), 0)
+
+    def test_duplicates_are_not_counted_as_sent(self):
+        transactions = presign(self.wallets, 10)
+        LoadGenerator('http://localhost', self.http.server_port, transactions, tps=100, connections=2).run()
+        single = LoadGenerator('http://localhost', self.http.server_port, transactions[:4], tps=100,
+                               connections=2).run()
+        batched = LoadGenerator('http://localhost', self.http.server_port, transactions, tps=100,
+                                connections=2, batch=5).run()
+        self.assertEqual(single['transactions'], 0)
+        self.assertEqual(single['errors'], {'duplicate': 4})
+        self.assertEqual(batched['transactions'], 0)
+        self.assertEqual(batched['errors'], {'duplicate': 10})
@@ -0,0 +1,75 @@
+from unittest import TestCase
+from wallet_pool import take_wallets
+from mempool import Mempool, transaction_size
+from utils import generate_signed_transaction
+from codec import short_id
+from custom_types import Transaction
+
+
+class TestMempool(TestCase):
+    wa, wb = take_wallets(2)
+
+    def test_add_deduplicates_by_txid(self):
+        mempool = Mempool()
+        txn = generate_signed_transaction(self.wa, self.wb, 10)
+        self.assertTrue(mempool.add(txn))
+        self.assertFalse(mempool.add(txn))
+        self.assertEqual(len(mempool), 1)
+        self.assertIn(txn.txid, mempool)
+
+    def test_transactions_ordered_by_ts(self):
+        mempool = Mempool()
+        txns = [generate_signed_transaction(self.wa, self.wb, 10 + i, ts=ts) for i, ts in enumerate([3, 1, 2])]
+        for txn in txns:
+            mempool.add(txn)
+        self.assertEqual([txn.ts for txn in mempool.transactions()], [1, 2, 3])
+
+    def test_evicts_oldest_over_count_limit(self):
+        mempool = Mempool(max_count=2)
+        txns = [generate_signed_transaction(self.wa, self.wb, 10 + i, ts=i) for i in range(3)]
+        for txn in txns:
+            mempool.add(txn)
+        self.assertEqual(mempool.transactions(), txns[1:])
+
+    def test_evicts_oldest_over_byte_limit(self):
+        txns = [generate_signed_transaction(self.wa, self.wb, 10 + i, ts=i) for i in range(3)]
+        mempool = Mempool(max_bytes=2 * transaction_size(txns[0]))
+        for txn in txns:
+            mempool.add(txn)
+        self.assertEqual(mempool.transactions(), txns[1:])
+        self.assertLessEqual(mempool.total_bytes, mempool.max_bytes)
+
+    def test_remove_and_sender_lookup(self):
+        mempool = Mempool()
+        txn_a = generate_signed_transaction(self.wa, self.wb, 10, ts=1)
+        txn_b = generate_signed_transaction(self.wb, self.wa, 10, ts=2)
+        mempool.add(txn_a)
+        mempool.add(txn_b)
+        self.assertEqual(mempool.by_sender(self.wa.public_key.fingerprint), [txn_a])
+        mempool.remove_transactions([txn_a])
+        self.assertEqual(mempool.by_sender(self.wa.public_key.fingerprint), [])
+        self.assertEqual(mempool.transactions(), [txn_b])
+        self.assertEqual(mempool.total_bytes, transaction_size(txn_b))
+
+    def test_short_id_lookup(self):
+        mempool = Mempool(max_count=1)
+        a, b = [generate_signed_transaction(self.wa, self.wb, 10 + i, ts=i) for i in range(2)]
+        mempool.add(a)
+        self.assertIs(mempool.get_by_short_id(short_id(a.txid)), a)
+        # evicted and removed transactions leave the index
+        mempool.add(b)
+        self.assertIsNone(mempool.get_by_short_id(short_id(a.txid)))
+        mempool.remove(b.txid)
+        self.assertIsNone(mempool.get_by_short_id(short_id(b.txid)))
+
+    def test_stale_count_stays_consistent(self):
+        mempool = Mempool(max_count=100)
+        for i in range(5000):
+            # the mempool does not check signatures, unsigned transactions keep this fast
+            txn = Transaction(self.wa.public_key, self.wb.public_key, 10, ts=i)
+            mempool.add(txn)
+            if i % 7 == 0:
+                mempool.remove(txn.txid)
+            self.assertGreaterEqual(mempool._stale, 0)
+        live = sum(1 for entry in mempool._order[mempool._head:] if entry[2] in mempool)
+        self.assertEqual(len(mempool._order) - mempool._head - live, mempool._stale)
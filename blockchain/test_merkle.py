@@ -0,0 +1,17 @@
+import hashlib
+from unittest import TestCase
+from merkle import merkle_root, merkle_proof, verify_merkle_proof
+
+
+class TestMerkle(TestCase):
+    def test_proof_for_every_leaf(self):
+        for n in [1, 2, 3, 5, 8]:
+            leaves = [hashlib.sha256(bytes([i])).digest() for i in range(n)]
+            root = merkle_root(leaves)
+            for i, leaf in enumerate(leaves):
+                self.assertTrue(verify_merkle_proof(leaf, merkle_proof(leaves, i), root))
+
+    def test_proof_rejects_other_leaf(self):
+        leaves = [hashlib.sha256(bytes([i])).digest() for i in range(4)]
+        root = merkle_root(leaves)
+        self.assertFalse(verify_merkle_proof(leaves[1], merkle_proof(leaves, 0), root))
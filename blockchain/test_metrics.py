@@ -0,0 +1,27 @@
+from unittest import TestCase
+from metrics import Registry
+
+
+class TestMetrics(TestCase):
+    def test_render_counters_gauges_and_histograms(self):
+        registry = Registry()
+        counter = registry.counter('checks_total', 'Checks')
+        counter.inc(result='valid')
+        counter.labels(result='valid').inc(2)
+        registry.gauge('queue_depth', 'Queue depth', lambda: 7)
+        histogram = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        text = registry.render()
+        self.assertIn('# TYPE checks_total counter', text)
+        self.assertIn('checks_total{result="valid"} 3', text)
+        self.assertIn('queue_depth 7', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count 3', text)
+        self.assertIs(registry.counter('checks_total', 'Checks'), counter)
+        with self.assertRaises(ValueError):
+            registry.gauge('checks_total', 'Checks')
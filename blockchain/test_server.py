@@ -0,0 +1,260 @@
+from unittest import TestCase, mock
+import base64
+import time
+import server
+from utils import generate_blockchain, generate_signed_transaction
+from codec import transactions_to_bytes, transaction_ids_from_bytes, indexed_transactions_to_bytes, short_id
+from client_utils import BINARY_CONTENT_TYPE, HOP_LIMIT_HEADER, verify_transaction_inclusion
+from custom_types import TX_VERSION_LEGACY
+from gossip import HOP_LIMIT
+from header import BlockHeader
+from wallet_pool import take_wallets
+from mining import MiningJob
+
+
+class TestServer(TestCase):
+    def setUp(self) -> None:
+        self.blockchain, self.accounts, self.wallets = generate_blockchain(length=2, n_transactions=1, n_users=3)
+        server.blockchain = self.blockchain
+        self.client = server.app.test_client()
+
+    @staticmethod
+    def _data(txn):
+        return {
+            'sender': str(txn.from_addr),
+            'receiver': str(txn.to_addr),
+            'amount': txn.amount,
+            'signature': base64.b64encode(txn.signature).decode('utf-8'),
+            'ts': txn.ts,
+            'version': txn.version
+        }
+
+    def test_new_transaction_is_verified(self):
+        txn = generate_signed_transaction(self.wallets[0], self.wallets[1], 1)
+        without_version = {k: v for k, v in self._data(txn).items() if k != 'version'}
+        without_ts = {k: v for k, v in self._data(txn).items() if k != 'ts'}
+        # read as a legacy transaction the version 2 signature does not verify
+        self.assertEqual(self.client.post('/transaction/new', json=without_version).status_code, 400)
+        self.assertEqual(self.client.post('/transaction/new', json=without_ts).status_code, 400)
+        self.assertEqual(self.client.post('/transaction/new', json=dict(self._data(txn), ts=None)).status_code, 400)
+        resp = self.client.post('/transaction/batch', json={'transactions': [dict(self._data(txn), ts='abc')]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['results'][0]['status'], 'rejected')
+        self.assertEqual(len(self.blockchain.mempool), 0)
+        resp = self.client.post('/transaction/new', json=self._data(txn))
+        self.assertEqual(resp.get_json()['status'], 'accepted')
+        self.assertIn(txn.txid, self.blockchain.mempool)
+        resp = self.client.post('/transaction/new', json=self._data(txn))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['status'], 'duplicate')
+
+    def test_transaction_batch(self):
+        valid = generate_signed_transaction(self.wallets[0], self.wallets[1], 1)
+        invalid = generate_signed_transaction(self.wallets[1], self.wallets[2], 1)
+        invalid.signature = b'123'
+        items = [self._data(valid), self._data(valid), self._data(invalid), {'sender': 'x'}]
+        resp = self.client.post('/transaction/batch', json={'transactions': items})
+        self.assertEqual(resp.status_code, 200)
+        statuses = [result['status'] for result in resp.get_json()['results']]
+        self.assertEqual(statuses, ['accepted', 'duplicate', 'invalid_signature', 'rejected'])
+        self.assertEqual(len(self.blockchain.mempool), 1)
+
+    def test_binary_transaction_batch(self):
+        txns = [generate_signed_transaction(self.wallets[0], self.wallets[1], i + 1) for i in range(3)]
+        resp = self.client.post(
+            '/transaction/batch',
+            data=transactions_to_bytes(txns),
+            content_type=BINARY_CONTENT_TYPE
+        )
+        self.assertEqual(resp.status_code, 200)
+        results = resp.get_json()['results']
+        self.assertEqual([r['status'] for r in results], ['accepted'] * 3)
+        self.assertEqual([r['txid'] for r in results], [txn.txid for txn in txns])
+
+    def test_transaction_ids_from_bytes(self):
+        txns = [generate_signed_transaction(self.wallets[0], self.wallets[1], i + 1) for i in range(2)]
+        legacy = generate_signed_transaction(self.wallets[1], self.wallets[2], 1)
+        legacy.version = TX_VERSION_LEGACY
+        ids = transaction_ids_from_bytes(transactions_to_bytes(txns + [legacy]))
+        self.assertEqual([txid for _, txid in ids], [txns[0].txid, txns[1].txid, None])
+
+    def test_echoes_are_dropped_after_mining(self):
+        txns = [generate_signed_transaction(self.wallets[0], self.wallets[1], i + 1) for i in range(3)]
+        payload = transactions_to_bytes(txns)
+        self.client.post('/transaction/batch', data=payload, content_type=BINARY_CONTENT_TYPE)
+        self.blockchain.mine(take_wallets(1)[0].public_key)
+        self.assertEqual(len(self.blockchain.mempool), 0)
+        with mock.patch('blockchain_impl.verify_batch') as verify_batch:
+            resp = self.client.post('/transaction/batch', data=payload, content_type=BINARY_CONTENT_TYPE)
+        self.assertEqual([r['status'] for r in resp.get_json()['results']], ['duplicate'] * 3)
+        self.assertEqual(len(self.blockchain.mempool), 0)
+        self.assertEqual(verify_batch.call_args.args[0], [])
+
+    def test_hop_limit(self):
+        with mock.patch.object(self.blockchain.broadcaster, 'submit') as submit:
+            for ts, header in enumerate([None, '3', '0', '100', 'x']):
+                txn = generate_signed_transaction(self.wallets[0], self.wallets[1], 1, ts=ts)
+                headers = {} if header is None else {HOP_LIMIT_HEADER: header}
+                self.client.post('/transaction/new', json=self._data(txn), headers=headers)
+        self.assertEqual([call.args[1] for call in submit.call_args_list], [HOP_LIMIT - 1, 2, HOP_LIMIT - 1])
+
+    def test_transaction_proof_verifies_against_headers(self):
+        txn = generate_signed_transaction(self.wallets[0], self.wallets[1], 1)
+        self.blockchain.add_transaction(txn)
+        self.blockchain.mine(take_wallets(1)[0].public_key)
+        self.assertEqual(len(self.blockchain.chain), 3)
+
+        proof = self.client.get(f'/transaction/{txn.txid}/proof').get_json()['message']
+        resp = self.client.get('/headers', query_string={'start': 1, 'count': 10})
+        headers = [BlockHeader.from_dict(h) for h in resp.get_json()['message']]
+        genesis_hash = self.blockchain.chain[0].block_hash
+        self.assertTrue(verify_transaction_inclusion(txn.txid, proof, headers, 1, genesis_hash))
+
+        other = generate_signed_transaction(self.wallets[1], self.wallets[2], 1)
+        self.assertFalse(verify_transaction_inclusion(other.txid, proof, headers, 1, genesis_hash))
+        self.assertEqual(self.client.get(f'/transaction/{other.txid}/proof').status_code, 404)
+        # the genesis block commits to no merkle root, so none of its transactions has a proof
+        genesis_txid = self.blockchain.chain[0].transactions[0].txid
+        self.assertEqual(self.client.get(f'/transaction/{genesis_txid}/proof').status_code, 400)
+
+    def test_block_and_address_queries(self):
+        tip = self.blockchain.chain[-1]
+        resp = self.client.get(f'/block/{tip.block_hash}')
+        self.assertEqual(resp.get_json()['message']['height'], 1)
+        resp = self.client.get('/block/height/1')
+        self.assertEqual(resp.get_json()['message']['block_hash'], tip.block_hash)
+        self.assertEqual(self.client.get('/block/height/9').status_code, 404)
+
+        address = self.wallets[0].public_key.fingerprint
+        resp = self.client.get(f'/address/{address}/balance')
+        self.assertEqual(resp.get_json()['message']['balance'], self.accounts[0])
+
+        for i in range(3):
+            self.blockchain.add_transaction(generate_signed_transaction(self.wallets[0], self.wallets[2], 1, ts=i))
+        self.blockchain.mine(take_wallets(1)[0].public_key)
+        resp = self.client.get(f'/address/{address}/history', query_string={'page': 0, 'page_size': 2})
+        message = resp.get_json()['message']
+        postings = self.blockchain.address_index[address]
+        self.assertEqual(message['total'], len(postings))
+        self.assertEqual([h['txid'] for h in message['history']], [p[2] for p in postings[::-1][:2]])
+        self.assertEqual(message['history'][0]['amount'], -1)
+
+    def test_mine_runs_as_background_job(self):
+        miner = str(take_wallets(1)[0].public_key)
+        resp = self.client.get('/blockchain/mine', json={'miner_addr': miner})
+        self.assertEqual(resp.status_code, 202)
+        job_id = resp.get_json()['message']['job_id']
+        job = self.blockchain.mining_jobs[job_id]
+        deadline = time.time() + 30
+        while not job.done and time.time() < deadline:
+            time.sleep(0.01)
+        status = self.client.get(f'/blockchain/mine/{job_id}').get_json()['message']
+        self.assertEqual(status['status'], 'succeeded')
+        self.assertEqual(status['block_hash'], self.blockchain.chain[-1].block_hash)
+        self.assertEqual(self.client.get('/blockchain/mine/unknown').status_code, 404)
+
+    def test_mine_rejects_bad_workers_and_concurrent_jobs(self):
+        miner = str(take_wallets(1)[0].public_key)
+        for workers in ('lots', -1, True, 2.5):
+            resp = self.client.get('/blockchain/mine', json={'miner_addr': miner, 'workers': workers})
+            self.assertEqual(resp.status_code, 400)
+        running = MiningJob(self.blockchain.chain[-1].block_hash)
+        running.status = 'running'
+        self.blockchain.mining_jobs[running.id] = running
+        resp = self.client.get('/blockchain/mine', json={'miner_addr': miner})
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.get_json()['message']['job_id'], running.id)
+
+    def test_negative_start_is_rejected(self):
+        for path in ('/headers', '/blocks'):
+            self.assertEqual(self.client.get(path, query_string={'start': -1}).status_code, 400)
+
+    def test_metrics(self):
+        txn = generate_signed_transaction(self.wallets[0], self.wallets[1], 1)
+        self.client.post('/transaction/batch', json={'transactions': [self._data(txn)]})
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        text = resp.get_data(as_text=True)
+        self.assertIn('mempool_transactions 1', text)
+        self.assertIn('chain_height 1', text)
+        self.assertIn('broadcast_queue_depth 0', text)
+        self.assertIn('# TYPE signature_verifications_total counter', text)
+        self.assertIn('http_request_seconds_count{method="POST",route="/transaction/batch",status="200"}', text)
+
+    def test_block_relay(self):
+        source = server.BlockChain(chain=list(self.blockchain.chain), reward=self.blockchain.reward,
+                                   difficulty=self.blockchain.difficulty)
+        txn = generate_signed_transaction(self.wallets[0], self.wallets[1], 1)
+        source.add_transaction(txn)
+        block = source.mine(take_wallets(1)[0].public_key)
+
+        payload = block.to_bytes()
+        headers = {'Content-Type': BINARY_CONTENT_TYPE}
+        resp = self.client.post('/block/new', data=payload, headers=headers)
+        self.assertEqual(resp.get_json()['message']['status'], 'accepted')
+        self.assertEqual(self.blockchain.chain[-1].block_hash, block.block_hash)
+        resp = self.client.post('/block/new', data=payload, headers=headers)
+        self.assertEqual(resp.get_json()['message']['status'], 'duplicate')
+        resp = self.client.post('/block/new', data=self.blockchain.chain[1].to_bytes(), headers=headers)
+        self.assertEqual(resp.get_json()['message']['status'], 'duplicate')
+
+        status = self.client.get(f'/transaction/{txn.txid}').get_json()['message']
+        self.assertEqual(status['status'], 'confirmed')
+        self.assertEqual(status['block_hash'], block.block_hash)
+        self.assertEqual(self.client.get('/transaction/abc').status_code, 404)
+        self.assertIsNotNone(self.client.get(f'/block/{block.block_hash}').get_json()['message']['received_at'])
+        # a relayed copy of a confirmed transaction does not go back into the mempool
+        self.assertFalse(self.blockchain.add_transaction(txn))
+
+    def test_compact_block_relay(self):
+        source = server.BlockChain(chain=list(self.blockchain.chain), reward=self.blockchain.reward,
+                                   difficulty=self.blockchain.difficulty)
+        txns = [generate_signed_transaction(self.wallets[0], self.wallets[1], 1, ts=i) for i in range(3)]
+        for txn in txns:
+            source.add_transaction(txn)
+        self.blockchain.add_transaction(txns[0])
+        self.blockchain.add_transaction(txns[2])
+        block = source.mine(take_wallets(1)[0].public_key)
+        compact = block.to_compact_bytes()
+        self.assertLess(len(compact), len(block.to_bytes()))
+
+        resp = self.client.post('/block/compact', data=compact, content_type=BINARY_CONTENT_TYPE)
+        self.assertEqual(resp.get_json()['message'], {'status': 'missing', 'missing': [1]})
+        self.assertEqual(len(self.blockchain.chain), 2)
+        payload = compact + indexed_transactions_to_bytes([(1, txns[1])])
+        resp = self.client.post('/block/compact', data=payload, content_type=BINARY_CONTENT_TYPE)
+        self.assertEqual(resp.get_json()['message']['status'], 'accepted')
+        self.assertEqual(self.blockchain.chain[-1].block_hash, block.block_hash)
+        self.assertEqual(self.blockchain.balances, source.balances)
+        self.assertEqual(len(self.blockchain.mempool), 0)
+        resp = self.client.post('/block/compact', data=compact, content_type=BINARY_CONTENT_TYPE)
+        self.assertEqual(resp.get_json()['message']['status'], 'duplicate')
+
+    def test_compact_block_short_id_collision(self):
+        txns = [generate_signed_transaction(self.wallets[0], self.wallets[1], 1, ts=i) for i in range(2)]
+        block = server.Block(self.blockchain.chain[-1], list(txns), reward=self.blockchain.reward, difficulty=1)
+        block.mine(take_wallets(1)[0].public_key)
+        other = generate_signed_transaction(self.wallets[0], self.wallets[2], 1, ts=1)
+        # the pending transaction behind the second short id is not the one in the block
+        lookup = {short_id(txns[0].txid): txns[0], short_id(txns[1].txid): other}.get
+        compact = block.to_compact_bytes()
+        self.assertEqual(server.Block.from_compact_bytes(compact, self.blockchain.chain[-1], lookup), (None, [0, 1]))
+        rebuilt, missing = server.Block.from_compact_bytes(
+            compact + indexed_transactions_to_bytes([(1, txns[1])]), self.blockchain.chain[-1], lookup)
+        self.assertEqual(missing, [])
+        self.assertEqual(rebuilt.merkle_root, block.merkle_root)
+
+    def test_compact_block_without_coinbase_is_rejected(self):
+        block = server.Block(self.blockchain.chain[-1], [], reward=self.blockchain.reward, difficulty=1)
+        block.mine(take_wallets(1)[0].public_key)
+        block.coin_base_transaction = None
+        resp = self.client.post('/block/compact', data=block.to_compact_bytes(), content_type=BINARY_CONTENT_TYPE)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_invalid_block_is_rejected(self):
+        block = server.Block(self.blockchain.chain[-1], [], reward=self.blockchain.reward, difficulty=1)
+        block.mine(take_wallets(1)[0].public_key)
+        block.block_hash = '0' + block.block_hash[1:-1] + ('0' if block.block_hash[-1] != '0' else '1')
+        resp = self.client.post('/block/new', data=block.to_bytes(), content_type=BINARY_CONTENT_TYPE)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(len(self.blockchain.chain), 2)
@@ -0,0 +1,50 @@
+import threading
+from unittest import TestCase
+from werkzeug.serving import make_server
+import server
+from blockchain_impl import Block, BlockChain
+from client_utils import sync_chain, stream_blocks
+from wallet_pool import take_wallets
+from utils import generate_blockchain, generate_signed_transaction
+
+
+class TestSync(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.source, accounts, wallets = generate_blockchain(length=6, n_transactions=2, n_users=3)
+        for _ in range(2):
+            cls.source.add_transaction(generate_signed_transaction(wallets[0], wallets[1], 1))
+            cls.source.mine(take_wallets(1)[0].public_key)
+        server.blockchain = cls.source
+        cls.http = make_server('localhost', 0, server.app, threaded=True)
+        cls.peer = ('http://localhost', cls.http.server_port)
+        threading.Thread(target=cls.http.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.http.shutdown()
+
+    def _fresh_node(self) -> BlockChain:
+        genesis = Block.from_bytes(self.source.chain[0].to_bytes(), None)
+        return BlockChain(chain=[genesis], reward=10, difficulty=1)
+
+    def test_stream_blocks_ndjson(self):
+        host, port = self.peer
+        blocks = list(stream_blocks(host, port, 2, 3, binary=False))
+        self.assertEqual([b['height'] for b in blocks], [2, 3, 4])
+        self.assertEqual(blocks[0]['block_hash'], self.source.chain[2].block_hash)
+
+    def test_sync_from_several_peers(self):
+        node = self._fresh_node()
+        added = sync_chain(node, [self.peer, self.peer], batch_size=2, window=2)
+        self.assertEqual(added, len(self.source.chain) - 1)
+        self.assertEqual([b.block_hash for b in node.chain], [b.block_hash for b in self.source.chain])
+        self.assertEqual(node.balances, self.source.balances)
+        self.assertEqual(sync_chain(node, [self.peer]), 0)
+
+    def test_sync_skips_unreachable_peers(self):
+        node = self._fresh_node()
+        # nothing listens on port 1
+        added = sync_chain(node, [('http://localhost', 1), self.peer], batch_size=4)
+        self.assertEqual(added, len(self.source.chain) - 1)
+        self.assertEqual(sync_chain(node, [('http://localhost', 1)]), 0)
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+from blockchain_impl import verify
+from signatures import ED25519
+from utils import generate_signed_transaction
+from wallet_pool import WalletPool, save_wallets, load_wallets
+
+
+class TestWalletPool(TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'pool.bin')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_take_hands_out_distinct_wallets(self):
+        pool = WalletPool(self.path, scheme=ED25519)
+        first = pool.take(3)
+        second = pool.take(2)
+        self.assertEqual(len(pool), 5)
+        self.assertEqual(len({w.public_key for w in first + second}), 5)
+
+        reopened = WalletPool(self.path, scheme=ED25519)
+        self.assertEqual(len(reopened), 5)
+        self.assertEqual([w.public_key for w in reopened.take(5)], [w.public_key for w in first + second])
+        txn = generate_signed_transaction(reopened[1], reopened[2], amount=1)
+        self.assertTrue(verify(first[1].public_key, txn))
+
+    def test_reopen_is_fast(self):
+        WalletPool(self.path, scheme=ED25519).ensure(2000)
+        start = time.perf_counter()
+        wallets = WalletPool(self.path, scheme=ED25519).take(2000)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(len(wallets), 2000)
+
+    def test_ensure_appends_records(self):
+        pool = WalletPool(self.path, scheme=ED25519)
+        first = pool.take(2)
+        with open(self.path, 'rb') as f:
+            before = f.read()
+        # a record cut short by an interrupted append
+        with open(self.path, 'ab') as f:
+            f.write(b'\x01\x00')
+        pool.take(2)
+        with open(self.path, 'rb') as f:
+            self.assertTrue(f.read().startswith(before))
+        reopened = WalletPool(self.path, scheme=ED25519)
+        self.assertEqual(len(reopened), 4)
+        self.assertEqual([w.public_key for w in reopened.take(2)], [w.public_key for w in first])
+
+    def test_save_and_load_mixed_schemes(self):
+        pool = WalletPool(self.path + '.rsa')
+        wallets = pool.take(1) + WalletPool(self.path + '.ed', scheme=ED25519).take(1)
+        save_wallets(self.path, wallets)
+        loaded = load_wallets(self.path)
+        self.assertEqual([w.public_key for w in loaded], [w.public_key for w in wallets])
+        self.assertEqual(str(loaded[0].private_key), str(wallets[0].private_key))
+
+    def test_pool_file_is_private(self):
+        WalletPool(self.path, scheme=ED25519).ensure(1)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
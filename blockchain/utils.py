@@ -1,6 +1,9 @@
 from blockchain_impl import Block, Transaction, Wallet, BlockChain
-from custom_types import GenesisPublicKey, PublicKey, PrivateKey
+from custom_types import GenesisPublicKey, PrivateKey
+from signatures import DEFAULT_SCHEME
+from wallet_pool import take_wallets, save_wallets
 from cryptography.hazmat.primitives import serialization
+import os
 import random
 from typing import List
 import pickle
@@ -12,11 +15,8 @@ def generate_random_hash():
     return secrets.token_hex(20)
 
 
-def generate_random_transactions(n_users: int, n_txn: int):
-    wallets: List[Wallet] = []
-    for _ in range(n_users):
-        w = Wallet()
-        wallets.append(w)
+def generate_random_transactions(n_users: int, n_txn: int, scheme: str = DEFAULT_SCHEME):
+    wallets: List[Wallet] = take_wallets(n_users, scheme)
     results = []
     for i in range(n_txn):
         i = j = 0
@@ -44,8 +44,12 @@ def generate_blockchain(length: int,
                         n_transactions: int = 2,
                         n_users: int = 3,
                         reward: int = 10,
-                        difficulty: int = 1):
-    wallets = [Wallet() for _ in range(n_users)]
+                        difficulty: int = 1,
+                        scheme: str = DEFAULT_SCHEME,
+                        wallets: List[Wallet] = None):
+    # test fixtures come from the shared wallet pool, nodes pass keys of their own
+    if wallets is None:
+        wallets = take_wallets(n_users, scheme)
     accounts = [100 for _ in range(n_users)]
     miner_addr = wallets[0].public_key
 
@@ -55,7 +59,7 @@ def generate_blockchain(length: int,
         for _ in range(n_transactions):
             sender_idx = random.randint(0, n_users - 1)
             while accounts[sender_idx] <= 1:
-                sender_idx = random.randint(0, n_users)
+                sender_idx = random.randint(0, n_users - 1)
             receiver_idx = (sender_idx + 1) % n_users
             amount = random.randint(1, accounts[sender_idx] - 1)
             txn = generate_signed_transaction(
@@ -80,15 +84,15 @@ def generate_blockchain(length: int,
                     to_addr=wallets[i].public_key,
                     amount=100
                 ) for i in range(n_users)],
-                reward=10,
-                difficulty=1
+                reward=reward,
+                difficulty=difficulty
             )
         else:
             block = Block(
                 prev_block=prev_block,
                 transactions=_get_transactions(),
-                reward=10,
-                difficulty=1
+                reward=reward,
+                difficulty=difficulty
             )
         if not first:
             block.mine(miner_addr)
@@ -105,32 +109,10 @@ def generate_blockchain(length: int,
     ), accounts, wallets
 
 
-def deserialize_public_key(data: str) -> PublicKey:
-    return PublicKey(serialization.load_pem_public_key(data.encode('utf-8')))
-
-
 def deserialize_private_key(data: str) -> PrivateKey:
     return PrivateKey(serialization.load_pem_private_key(data.encode('utf-8'), password=None))
 
 
-def pickle_wallets(wallets: List[Wallet]):
-    wallets_serial = []
-    for w in wallets:
-        wallets_serial.append((str(w.public_key), str(w.private_key)))
-    with open('tmp/wallets', 'wb') as f:
-        pickle.dump(wallets_serial, f)
-
-
-def unpickle_wallets(file: str) -> List[Wallet]:
-    with open(file, 'rb') as f:
-        wallets_serial = pickle.load(f)
-    wallets = []
-    for w in wallets_serial:
-        wd = Wallet(public_key=deserialize_public_key(w[0]), private_key=deserialize_private_key(w[1]))
-        wallets.append(wd)
-    return wallets
-
-
 def pickle_accounts(accounts: List[int]):
     with open('tmp/accounts', 'wb') as f:
         pickle.dump(accounts, f)
@@ -143,5 +125,6 @@ def unpickle_accounts(file: str) -> List[int]:
 
 
 def save_accounts_and_wallets(accounts: List[int], wallets: List[Wallet]):
+    os.makedirs('tmp', exist_ok=True)
     pickle_accounts(accounts)
-    pickle_wallets(wallets)
+    save_wallets('tmp/wallets', wallets)
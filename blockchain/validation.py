@@ -0,0 +1,42 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple, Union, Iterator, Callable
+from codec import address_from_bytes
+from merkle import merkle_root
+from mining import BINARY_NONCE
+
+# (height, prefix, nonce, binary nonce, block hash, difficulty, merkle root, merkle leaves)
+HashJob = Tuple[int, bytes, int, bool, str, int, str, List[bytes]]
+# (height, encoded public key, signed bytes, signature)
+SignatureJob = Tuple[int, bytes, bytes, bytes]
+
+CHUNK_SIZE = 64
+
+
+def check_hash(job: HashJob) -> Union[str, None]:
+    """
+    Recompute a block hash and check its proof of work, returns an error message or None.
+    Header blocks also get their merkle root recomputed from the leaves.
+    """
+    height, prefix, nonce, binary_nonce, block_hash, difficulty, root, leaves = job
+    if binary_nonce and merkle_root(leaves).hex() != root:
+        return f"Wrong merkle root at height {height}"
+    nonce_bytes = BINARY_NONCE.pack(nonce) if binary_nonce else str(nonce).encode()
+    calculated_hash = hashlib.sha256(prefix + nonce_bytes).hexdigest()
+    if calculated_hash != block_hash:
+        return f"Wrong block hash at height {height}, expected hash {calculated_hash} got hash {block_hash}"
+    if block_hash[:difficulty] != "0" * difficulty:
+        return f"Wrong block {block_hash} at height {height} with difficulty {difficulty}"
+    return None
+
+
+def check_signature(job: SignatureJob) -> bool:
+    _, key, data, signature = job
+    return address_from_bytes(key).verify(data, signature)
+
+
+def submit(func: Callable, jobs: List, pool: Union[ProcessPoolExecutor, None]) -> Iterator:
+    # the pool queues every job right away, results are collected lazily in order
+    if pool is None:
+        return map(func, jobs)
+    return pool.map(func, jobs, chunksize=CHUNK_SIZE)
@@ -0,0 +1,159 @@
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, List, Union
+from custom_types import Wallet, PrivateKey, PublicKey
+from signatures import DEFAULT_SCHEME, get_scheme, schemes_by_code
+
+MAGIC = b'WPOOL1'
+# scheme code, key length, followed by the private key bytes
+RECORD_HEADER = struct.Struct('>BH')
+POOL_DIR_ENV = 'WALLET_POOL_DIR'
+# private keys, readable by the owner only
+FILE_MODE = 0o600
+DIR_MODE = 0o700
+# per-checkout default, the system temp dir is shared with every other local user
+DEFAULT_POOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp')
+
+
+class WalletPool:
+    """
+    Key pairs generated once and kept in a file of length-prefixed private keys.
+    The file is memory mapped and only the record offsets are read on open, a wallet is decoded the
+    first time its index is used. take hands out wallets no other caller of this pool object has
+    received yet, generating and appending more keys when the file runs out.
+    """
+
+    def __init__(self, path: str, scheme: str = DEFAULT_SCHEME):
+        self.path = path
+        self.scheme = get_scheme(scheme)
+        self._mm: Union[mmap.mmap, None] = None
+        self._offsets: List[int] = []
+        # end of the last complete record
+        self._end = 0
+        self._wallets: Dict[int, Wallet] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a wallet pool")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offsets = []
+        pos = len(MAGIC)
+        while pos + RECORD_HEADER.size <= len(mm):
+            _, length = RECORD_HEADER.unpack_from(mm, pos)
+            if pos + RECORD_HEADER.size + length > len(mm):
+                break
+            offsets.append(pos)
+            pos += RECORD_HEADER.size + length
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = mm
+        self._offsets = offsets
+        self._end = pos
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> Wallet:
+        with self._lock:
+            wallet = self._wallets.get(index)
+            if wallet is None:
+                code, length = RECORD_HEADER.unpack_from(self._mm, self._offsets[index])
+                start = self._offsets[index] + RECORD_HEADER.size
+                key = schemes_by_code[code].load_private_bytes(self._mm[start:start + length])
+                wallet = Wallet(public_key=PublicKey(key.public_key()), private_key=PrivateKey(key))
+                self._wallets[index] = wallet
+            return wallet
+
+    def ensure(self, count: int):
+        """
+        Generate and store keys until the pool holds at least count wallets.
+        """
+        with self._lock:
+            missing = count - len(self._offsets)
+            if missing <= 0:
+                return
+            start = len(self._offsets)
+            wallets = [Wallet(scheme=self.scheme.name) for _ in range(missing)]
+            self._append(b''.join(_record(w) for w in wallets))
+            self._load()
+            # keys generated here are used as they are, only keys read back from the file get decoded
+            for i, wallet in enumerate(wallets):
+                self._wallets[start + i] = wallet
+
+    def take(self, count: int) -> List[Wallet]:
+        with self._lock:
+            start = self._next
+            self._next += count
+        self.ensure(start + count)
+        return [self[i] for i in range(start, start + count)]
+
+    def _append(self, records: bytes):
+        _make_dir(self.path)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, FILE_MODE)
+        os.chmod(self.path, FILE_MODE)
+        with os.fdopen(fd, 'r+b') as f:
+            if self._mm is None:
+                f.truncate(0)
+                f.write(MAGIC)
+            else:
+                # a partial record left by an interrupted append is written over
+                f.truncate(self._end)
+                f.seek(self._end)
+            f.write(records)
+
+
+def _record(wallet: Wallet) -> bytes:
+    key = wallet.private_key.to_bytes()
+    return RECORD_HEADER.pack(wallet.private_key.scheme.code, len(key)) + key
+
+
+def _make_dir(path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=DIR_MODE, exist_ok=True)
+
+
+def save_records(path: str, records: List[bytes]):
+    _make_dir(path)
+    # written next to the target and renamed so readers never see a half written pool,
+    # the file is created owner-only so the keys are never readable by others
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, FILE_MODE)
+    os.chmod(tmp_path, FILE_MODE)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC + b''.join(records))
+    os.replace(tmp_path, path)
+
+
+def save_wallets(path: str, wallets: List[Wallet]):
+    save_records(path, [_record(w) for w in wallets])
+
+
+def load_wallets(path: str) -> List[Wallet]:
+    pool = WalletPool(path)
+    return [pool[i] for i in range(len(pool))]
+
+
+_default_pools: Dict[str, WalletPool] = {}
+_default_lock = threading.Lock()
+
+
+def default_pool(scheme: str = DEFAULT_SCHEME) -> WalletPool:
+    # shared by every caller in the process, the file is reused by later processes
+    with _default_lock:
+        pool = _default_pools.get(scheme)
+        if pool is None:
+            directory = os.environ.get(POOL_DIR_ENV, DEFAULT_POOL_DIR)
+            pool = _default_pools[scheme] = WalletPool(os.path.join(directory, f'wallet_pool_{scheme}.bin'), scheme)
+        return pool
+
+
+def take_wallets(count: int, scheme: str = DEFAULT_SCHEME) -> List[Wallet]:
+    return default_pool(scheme).take(count)